@@ -0,0 +1,105 @@
+"""
+Start-up import cost of each `hivdb3.entry` subcommand
+
+Usage: python -m benchmarks.importtime [COMMAND ...]
+
+Every command is run as `python -X importtime -m hivdb3.entry COMMAND
+--help` in a fresh interpreter, which imports exactly what a real
+invocation imports. The report lists the total import time and the
+slowest top-level imports. The run fails if a command other than
+those in `HEAVY_COMMANDS` imports one of the heavy database modules,
+or if the median import time exceeds `--max-ms`.
+"""
+import re
+import sys
+import statistics
+import subprocess
+import click
+from typing import Dict, List, Set, Tuple
+
+from hivdb3.cli import LAZY_COMMANDS
+
+IMPORTTIME_PATTERN = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$'
+)
+
+HEAVY_MODULES = {'sqlalchemy', 'sqlite_utils', 'psycopg2', 'questionary'}
+
+# commands which are expected to import HEAVY_MODULES
+HEAVY_COMMANDS = {'build-sqlite', 'db-to-sqlite'}
+
+
+def measure(command: str) -> Tuple[int, Dict[str, int], Set[str]]:
+    """
+    Return (total µs, cumulative µs of top-level imports, modules)
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime',
+         '-m', 'hivdb3.entry', command, '--help'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        encoding='UTF-8',
+        check=True
+    )
+    total = 0
+    toplevel: Dict[str, int] = {}
+    modules: Set[str] = set()
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        total += int(self_us)
+        modules.add(module)
+        if len(indent) == 1:
+            toplevel[module] = int(cumulative_us)
+    return total, toplevel, modules
+
+
+@click.command()
+@click.argument('commands', nargs=-1)
+@click.option('--repeat', type=int, default=5, show_default=True)
+@click.option('--top', type=int, default=5, show_default=True,
+              help='Number of slowest top-level imports to show')
+@click.option('--max-ms', type=float, default=200., show_default=True,
+              help='Fail if the median import time exceeds this')
+def main(
+    commands: Tuple[str, ...],
+    repeat: int,
+    top: int,
+    max_ms: float
+) -> None:
+    failures: List[str] = []
+    for command in commands or sorted(LAZY_COMMANDS):
+        totals: List[int] = []
+        toplevel: Dict[str, int] = {}
+        modules: Set[str] = set()
+        for _ in range(repeat):
+            total, toplevel, modules = measure(command)
+            totals.append(total)
+        median_ms = statistics.median(totals) / 1000
+        click.echo('{:<28} {:>8.1f} ms  ({} modules)'
+                   .format(command, median_ms, len(modules)))
+        slowest = sorted(toplevel.items(), key=lambda item: -item[1])
+        for module, cumulative_us in slowest[:top]:
+            click.echo('    {:<40} {:>8.1f} ms'
+                       .format(module, cumulative_us / 1000))
+
+        if command not in HEAVY_COMMANDS:
+            heavy = sorted(
+                HEAVY_MODULES & {mod.split('.')[0] for mod in modules})
+            if heavy:
+                failures.append('{} imports {}'
+                                .format(command, ', '.join(heavy)))
+            if median_ms > max_ms:
+                failures.append('{} takes {:.1f} ms to import (> {:g} ms)'
+                                .format(command, median_ms, max_ms))
+
+    if failures:
+        for failure in failures:
+            click.echo(failure, err=True)
+        raise click.Abort()
+
+
+if __name__ == '__main__':
+    main()
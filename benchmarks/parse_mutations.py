@@ -0,0 +1,115 @@
+"""
+Throughput of the memoized mutation parsers vs. the per-row regex path
+
+Usage: python -m benchmarks.parse_mutations [WORKSHEET_CSV ...]
+
+Without arguments a synthetic column is used, in which a small pool of
+baseline mutation lists repeats across many rows, as it does across
+the ivsel worksheets.
+"""
+import random
+import timeit
+import click
+from typing import List, Optional, Set, Tuple
+
+from hivdb3.utils.csvv import iter_csv
+from hivdb3.utils.mutations import (
+    MUTATION_PATTERN,
+    ParsedMutation,
+    parse_mutation_list,
+    parse_mutations_batch
+)
+
+MUTATION_COLUMNS = [
+    'Baseline mutations',
+    'Delta mutations',
+    'CA Mutations',
+    'PR Mutations',
+    'RT Mutations',
+    'IN Mutations'
+]
+
+
+def parse_per_row(
+    column: List[Optional[str]]
+) -> List[Tuple[str, int, Set[str]]]:
+    """
+    The parsing done by load_mutations before memoization
+    """
+    result: List[Tuple[str, int, Set[str]]] = []
+    for text in column:
+        if text is None:
+            continue
+        for m in MUTATION_PATTERN.finditer(text):
+            aas: Set[str] = set(m.group('aas')
+                                .replace('/', '')
+                                .replace('ins', '')
+                                .replace('del', ''))
+            if 'ins' in m.group('aas'):
+                aas.add('ins')
+            if 'del' in m.group('aas'):
+                aas.add('del')
+            result.append((m.group('gene') or 'RT', int(m.group('pos')), aas))
+    return result
+
+
+def synthetic_column(num_rows: int, num_unique: int) -> List[Optional[str]]:
+    rand = random.Random(42)
+    aas = 'ACDEFGHIKLMNPQRSTVWY'
+    pool: List[str] = []
+    for _ in range(num_unique):
+        positions = sorted(rand.sample(range(1, 561), rand.randint(3, 25)))
+        pool.append('+'.join(
+            '{}{}{}'.format(rand.choice(aas), pos, rand.choice(aas))
+            for pos in positions
+        ))
+    return [rand.choice(pool) for _ in range(num_rows)]
+
+
+def worksheet_column(worksheets: Tuple[str, ...]) -> List[Optional[str]]:
+    column: List[Optional[str]] = []
+    for worksheet in worksheets:
+        for row in iter_csv(worksheet, optional_columns=MUTATION_COLUMNS):
+            column.extend(row[col] for col in MUTATION_COLUMNS if col in row)
+    return column
+
+
+@click.command()
+@click.argument('worksheets', nargs=-1, type=click.Path(exists=True))
+@click.option('--rows', type=int, default=20000, show_default=True)
+@click.option('--unique', type=int, default=200, show_default=True)
+@click.option('--repeat', type=int, default=5, show_default=True)
+def main(
+    worksheets: Tuple[str, ...],
+    rows: int,
+    unique: int,
+    repeat: int
+) -> None:
+    if worksheets:
+        column = worksheet_column(worksheets)
+    else:
+        column = synthetic_column(rows, unique)
+
+    def memoized() -> None:
+        parse_mutation_list.cache_clear()
+        result: List[ParsedMutation] = []
+        for text in column:
+            if text is not None:
+                result.extend(parse_mutation_list(text))
+
+    def batch() -> None:
+        parse_mutation_list.cache_clear()
+        parse_mutations_batch(column, 'RT')
+
+    baseline = min(timeit.repeat(
+        lambda: parse_per_row(column), number=1, repeat=repeat))
+    click.echo(f'{len(column)} rows')
+    click.echo(f'per-row regex : {len(column) / baseline:12,.0f} rows/s')
+    for name, func in [('memoized', memoized), ('batch', batch)]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        click.echo(f'{name:14s}: {len(column) / best:12,.0f} rows/s '
+                   f'({baseline / best:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
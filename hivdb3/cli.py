@@ -1,7 +1,55 @@
 import click
+import importlib
+from typing import Dict, List, Optional
 
+# command name -> module registering it with `@cli.command()`
+#
+# Modules are only imported when their command is invoked, so that a
+# `generate-*` call does not pay for e.g. SQLAlchemy in `db-to-sqlite`.
+LAZY_COMMANDS: Dict[str, str] = {
+    'build': 'hivdb3.commands.build',
+    'build-sqlite': 'hivdb3.commands.build_sqlite',
+    'compare-sqlite': 'hivdb3.commands.compare_sqlite',
+    'compile-ivsel': 'hivdb3.commands.compile_ivsel',
+    'db-to-sqlite': 'hivdb3.commands.db_to_sqlite',
+    'generate-derived-tables': 'hivdb3.commands.gen_derived_tables',
+    'generate-drugs': 'hivdb3.commands.gen_drugs',
+    'generate-gene-isolates': 'hivdb3.commands.gen_gene_isolates',
+    'generate-invitro-selection': 'hivdb3.commands.gen_invitro_selection',
+    'generate-isolate-tables': 'hivdb3.commands.gen_isolate_tables',
+    'generate-isolates': 'hivdb3.commands.gen_isolates',
+    'generate-ivsel-drugs': 'hivdb3.commands.gen_ivsel_drugs',
+    'generate-ivsel-isolates': 'hivdb3.commands.gen_ivsel_isolates',
+    'generate-mutations': 'hivdb3.commands.gen_mutations',
+    'generate-ref-amino-acid': 'hivdb3.commands.gen_ref_amino_acid',
+}
 
-@click.group()
+
+class LazyGroup(click.Group):
+    """
+    Group resolving subcommands from `LAZY_COMMANDS` on first use
+    """
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(LAZY_COMMANDS))
+
+    def get_command(
+        self,
+        ctx: click.Context,
+        cmd_name: str
+    ) -> Optional[click.Command]:
+        if cmd_name not in self.commands and cmd_name in LAZY_COMMANDS:
+            module = LAZY_COMMANDS[cmd_name]
+            importlib.import_module(module)
+            if cmd_name not in self.commands:
+                raise RuntimeError(
+                    'Module {} does not register command {!r}'
+                    .format(module, cmd_name)
+                )
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(cls=LazyGroup)
 def cli() -> None:
     pass
 
@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import types
+import hashlib
+import click
+from pathlib import Path
+from functools import partial
+from concurrent.futures import (
+    ProcessPoolExecutor, Future, FIRST_EXCEPTION, wait
+)
+from typing import (
+    Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+)
+
+from ..cli import cli
+from ..utils.cache import default_cache, file_digest, source_digest
+
+from .compile_ivsel import compile_worksheet_dir
+from .gen_isolate_tables import dump_isolate_tables
+from .gen_ref_amino_acid import dump_ref_amino_acid
+from .gen_derived_tables import (
+    update_derived_tables, derived_partition, DERIVED_TABLES
+)
+
+MANIFEST_FILE = '.build-manifest.json'
+
+# (st_mtime_ns, st_size, digest)
+FileStat = Tuple[int, int, str]
+
+
+class Node(NamedTuple):
+    name: str
+    inputs: List[str]
+    outputs: List[str]
+    # run in a worker process, so it must be picklable
+    run: Callable[[], object]
+    # the function whose module (and the hivdb3 modules it uses)
+    # is part of the node signature
+    func: Callable[..., Any]
+
+
+def module_closure(*names: str) -> List[str]:
+    """
+    Names of hivdb3 modules reachable from `names` through the
+    modules and functions they import
+    """
+    seen: Set[str] = set()
+    queue: List[str] = list(names)
+    while queue:
+        name = queue.pop()
+        if name in seen or name not in sys.modules:
+            continue
+        seen.add(name)
+        for value in vars(sys.modules[name]).values():
+            if isinstance(value, types.ModuleType):
+                dep: Optional[str] = value.__name__
+            else:
+                dep = getattr(value, '__module__', None)
+            if isinstance(dep, str) and dep.startswith('hivdb3.'):
+                queue.append(dep)
+    return sorted(seen)
+
+
+class Manifest:
+    """
+    Content digests of the files and nodes of the last build
+
+    The digest of a file is only recomputed if its mtime or size
+    changed; staleness itself is decided by content only.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.files: Dict[str, FileStat] = {}
+        self.nodes: Dict[str, str] = {}
+        self.code: Dict[str, str] = {}
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+            self.files = {
+                key: (stat[0], stat[1], stat[2])
+                for key, stat in data['files'].items()
+            }
+            self.nodes = data['nodes']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def digest(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        known = self.files.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        digest = file_digest(path)
+        self.files[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def signature(self, node: Node) -> Optional[str]:
+        """
+        Digest of everything a node is built from, or None if one of
+        its outputs is missing
+        """
+        sha = hashlib.sha256()
+        for path in node.outputs:
+            digest = self.digest(path)
+            if digest is None:
+                return None
+            sha.update(f'{path}\0{digest}\0'.encode('UTF-8'))
+        for path in node.inputs:
+            sha.update(f'{path}\0{self.digest(path)}\0'.encode('UTF-8'))
+        sha.update(self.code_digest(node.func.__module__).encode('UTF-8'))
+        return sha.hexdigest()
+
+    def code_digest(self, module: str) -> str:
+        if module not in self.code:
+            self.code[module] = source_digest(*module_closure(module))
+        return self.code[module]
+
+    def is_stale(self, node: Node) -> bool:
+        signature = self.signature(node)
+        return signature is None or self.nodes.get(node.name) != signature
+
+    def record(self, node: Node) -> None:
+        signature = self.signature(node)
+        if signature is not None:
+            self.nodes[node.name] = signature
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({'files': self.files, 'nodes': self.nodes}, fp)
+        os.replace(tmp_path, self.path)
+
+
+def csv_files(dirname: str) -> List[str]:
+    if not os.path.isdir(dirname):
+        return []
+    return [
+        os.path.join(dirname, fn)
+        for fn in sorted(os.listdir(dirname))
+        if fn.lower().endswith('.csv')
+    ]
+
+
+def payload_nodes(
+    worksheet_dir: str,
+    table_dir: str,
+    derived_dir: str
+) -> List[Node]:
+    """
+    The worksheet -> table DAG previously described by the Makefile
+    """
+    ws = worksheet_dir
+    tb = table_dir
+    nodes: List[Node] = []
+
+    ivsel_dir = os.path.join(ws, 'invitro_selection')
+    ivsel_worksheets = csv_files(ivsel_dir)
+    baseline_csv = os.path.join(ws, 'isolates', 'baseline_isolates.csv')
+    consensus_csv = os.path.join(ws, 'hiv1_consensus.csv')
+    extracols_csv = os.path.join(ws, 'isolate_extracols.csv')
+    ivsel_isolates_csv = os.path.join(
+        ws, 'isolates', 'invitro_selection_isolates.csv')
+    drugs_csv = os.path.join(tb, 'drugs.csv')
+    ivsel_names = [
+        os.path.basename(path)[:-len('-ivsel.csv')]
+        for path in ivsel_worksheets
+        if path.endswith('-ivsel.csv')
+    ]
+    ivsel_tables = [
+        os.path.join(tb, 'invitro_selection', f'{name}-ivsel.csv')
+        for name in ivsel_names
+    ]
+    nodes.append(Node(
+        name='ivsel',
+        inputs=ivsel_worksheets + [baseline_csv, consensus_csv, extracols_csv],
+        outputs=ivsel_tables + [
+            os.path.join(tb, 'invitro_selection_drugs', f'{name}-drugs.csv')
+            for name in ivsel_names
+        ] + [ivsel_isolates_csv, drugs_csv],
+        run=partial(
+            compile_worksheet_dir,
+            ivsel_dir,
+            baseline_csv,
+            consensus_csv,
+            extracols_csv,
+            os.path.join(tb, 'invitro_selection'),
+            os.path.join(tb, 'invitro_selection_drugs'),
+            ivsel_isolates_csv,
+            drugs_csv
+        ),
+        func=compile_worksheet_dir
+    ))
+
+    mutations_csvs = csv_files(os.path.join(tb, 'mutations.d'))
+    isolate_worksheets = csv_files(os.path.join(ws, 'isolates'))
+    if ivsel_isolates_csv not in isolate_worksheets:
+        isolate_worksheets.append(ivsel_isolates_csv)
+    for worksheet in isolate_worksheets:
+        fn = os.path.basename(worksheet)
+        outputs = [
+            os.path.join(tb, 'isolates.d', fn),
+            os.path.join(tb, 'gene_isolates.d', fn),
+            os.path.join(tb, 'mutations.d', fn)
+        ]
+        mutations_csvs.append(outputs[2])
+        nodes.append(Node(
+            name=f'isolates:{fn}',
+            inputs=[worksheet],
+            outputs=outputs,
+            run=partial(dump_isolate_tables, worksheet, *outputs),
+            func=dump_isolate_tables
+        ))
+
+    ref_aa_csv = os.path.join(tb, 'ref_amino_acid.csv')
+    nodes.append(Node(
+        name='ref_amino_acid',
+        inputs=[consensus_csv],
+        outputs=[ref_aa_csv],
+        run=partial(dump_ref_amino_acid, consensus_csv, ref_aa_csv),
+        func=dump_ref_amino_acid
+    ))
+
+    # existing tables of the directories are read too
+    ivsel_tables = sorted(set(
+        csv_files(os.path.join(tb, 'invitro_selection')) + ivsel_tables))
+    nodes.append(Node(
+        name='derived',
+        inputs=ivsel_tables + sorted(set(mutations_csvs)) + [
+            os.path.join(tb, 'resistance_mutations.csv')
+        ],
+        outputs=[
+            derived_partition(derived_dir, table, os.path.basename(path))
+            for table in DERIVED_TABLES
+            for path in ivsel_tables
+        ],
+        # incremental: only the partitions affected by changed inputs
+        run=partial(update_derived_tables, tb, derived_dir),
+        func=update_derived_tables
+    ))
+    return nodes
+
+
+def init_worker() -> None:
+    # parsed inputs, e.g. the consensus, are kept for the lifetime of
+    # the worker and shared by the nodes it runs
+    default_cache.memory = {}
+
+
+def build_nodes(
+    nodes: List[Node],
+    manifest: Manifest,
+    jobs: int,
+    force: bool = False,
+    dry_run: bool = False
+) -> List[str]:
+    """
+    Run the stale nodes in dependency order, return their names
+
+    A node depends on the nodes producing its inputs, and is checked
+    for staleness only once they have finished. Nodes run in a pool of
+    `jobs` processes, since their work is CPU-bound Python.
+    """
+    producers: Dict[str, str] = {
+        path: node.name for node in nodes for path in node.outputs}
+    deps: Dict[str, Set[str]] = {
+        node.name: {
+            producers[path] for path in node.inputs
+            if path in producers and producers[path] != node.name
+        }
+        for node in nodes
+    }
+    by_name: Dict[str, Node] = {node.name: node for node in nodes}
+    pending: Dict[str, Set[str]] = {
+        name: set(names) for name, names in deps.items()}
+    built: List[str] = []
+    running: Dict[Future, str] = {}
+
+    def ready() -> List[Node]:
+        names = [name for name, names in pending.items() if not names]
+        for name in names:
+            del pending[name]
+        return [by_name[name] for name in names]
+
+    def done(name: str) -> None:
+        for names in pending.values():
+            names.discard(name)
+
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker)
+    with executor:
+        while pending or running:
+            nodes = ready()
+            while nodes:
+                for node in nodes:
+                    if force or manifest.is_stale(node):
+                        built.append(node.name)
+                        if dry_run:
+                            click.echo(f'{node.name} is stale')
+                        else:
+                            running[executor.submit(node.run)] = node.name
+                            continue
+                    done(node.name)
+                nodes = ready()
+            if not running:
+                if pending:
+                    raise RuntimeError(
+                        'Dependency cycle among {}'
+                        .format(', '.join(sorted(pending))))
+                break
+            finished, _ = wait(running, return_when=FIRST_EXCEPTION)
+            for future in finished:
+                name = running.pop(future)
+                # re-raises the exception of a failed node
+                future.result()
+                manifest.record(by_name[name])
+                done(name)
+    return built
+
+
+@cli.command()
+@click.option(
+    '--worksheet-dir',
+    type=click.Path(file_okay=False),
+    default='payload/worksheets',
+    show_default=True)
+@click.option(
+    '--table-dir',
+    type=click.Path(file_okay=False),
+    default='payload/tables',
+    show_default=True)
+@click.option(
+    '--derived-dir',
+    type=click.Path(file_okay=False),
+    default='build/derived',
+    show_default=True)
+@click.option(
+    '-j', '--jobs',
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help='Number of nodes to build in parallel processes')
+@click.option(
+    '--force',
+    is_flag=True,
+    help='Rebuild every node regardless of the manifest')
+@click.option(
+    '-n', '--dry-run',
+    is_flag=True,
+    help='Only list the stale nodes')
+def build(
+    worksheet_dir: str,
+    table_dir: str,
+    derived_dir: str,
+    jobs: int,
+    force: bool,
+    dry_run: bool
+) -> None:
+    """
+    Rebuild the stale payload tables in process
+
+    A table is stale when the content of its inputs, of an existing
+    output, or of the code generating it changed since the last build.
+    """
+    start = time.monotonic()
+    manifest = Manifest(default_cache.cache_dir / MANIFEST_FILE)
+    nodes = payload_nodes(worksheet_dir, table_dir, derived_dir)
+    try:
+        built = build_nodes(nodes, manifest, jobs, force, dry_run)
+    finally:
+        if not dry_run:
+            manifest.save()
+    click.echo(
+        '{} of {} nodes {} in {:.2f}s'.format(
+            len(built), len(nodes),
+            'stale' if dry_run else 'rebuilt',
+            time.monotonic() - start),
+        err=True)
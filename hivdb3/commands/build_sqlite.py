@@ -0,0 +1,499 @@
+import os
+import re
+import csv
+import itertools
+import subprocess
+import click
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from datetime import date, datetime, timezone
+from sqlite_utils import Database
+from sqlite_utils.db import Table
+from typing import (
+    Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
+)
+
+from ..cli import cli
+from ..utils.dbml import DBMLColumn, DBMLSchema, DBMLTable, parse_dbml
+from ..utils.sqlite import begin_bulk_load, finish_bulk_load
+
+from .gen_derived_tables import derived_sql_table, derived_tables_current
+
+# the default of db-to-sqlite; sqlite_utils infers the column types
+# of a new table from its first batch, so both must use the same
+BATCH_SIZE = 10000
+
+# PostgreSQL limits identifiers to NAMEDATALEN - 1 bytes
+MAX_IDENTIFIER = 63
+
+Converter = Callable[[str], Any]
+
+BOOL_VALUES: Dict[str, bool] = {
+    't': True, 'true': True, 'y': True, 'yes': True, 'on': True, '1': True,
+    'f': False, 'false': False, 'n': False, 'no': False, 'off': False,
+    '0': False
+}
+
+INTEGER_TYPES = {'int', 'integer', 'int2', 'int4', 'int8', 'smallint',
+                 'bigint', 'serial', 'bigserial'}
+BOOL_TYPES = {'bool', 'boolean'}
+NUMERIC_TYPES = {'numeric', 'decimal'}
+FLOAT_TYPES = {'float', 'float4', 'float8', 'real', 'double'}
+DATE_TYPES = {'date'}
+TIMESTAMP_TYPES = {'timestamp', 'timestamptz'}
+TEXT_TYPES = {'varchar', 'text', 'char', 'character'}
+
+
+def parse_bool(value: str) -> bool:
+    try:
+        return BOOL_VALUES[value.strip().lower()]
+    except KeyError:
+        raise ValueError('invalid boolean {!r}'.format(value))
+
+
+def parse_numeric(scale: Optional[int]) -> Converter:
+    exponent = None if scale is None else Decimal(1).scaleb(-scale)
+
+    def convert(value: str) -> Decimal:
+        try:
+            number = Decimal(value.strip())
+        except InvalidOperation:
+            raise ValueError('invalid numeric {!r}'.format(value))
+        if exponent is not None:
+            # PostgreSQL rounds to the scale of the column, half away
+            # from zero
+            number = number.quantize(exponent, rounding=ROUND_HALF_UP)
+        return number
+    return convert
+
+
+def parse_timestamp(value: str) -> datetime:
+    stamp = datetime.fromisoformat(re.sub(r'Z$', '+00:00', value.strip()))
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    # PostgreSQL returns timestamptz in the session time zone (UTC)
+    return stamp.astimezone(timezone.utc)
+
+
+def parse_enum(name: str, choices: Tuple[str, ...]) -> Converter:
+    allowed = set(choices)
+
+    def convert(value: str) -> str:
+        if value not in allowed:
+            raise ValueError(
+                'invalid input value for enum {}: {!r}'.format(name, value))
+        return value
+    return convert
+
+
+def column_converter(
+    column: DBMLColumn,
+    enums: Dict[str, Tuple[str, ...]]
+) -> Converter:
+    """
+    Convert a CSV cell into the Python value psycopg2 would return for
+    the column, so that sqlite_utils stores it the same way as in a
+    database exported by `db-to-sqlite`
+    """
+    match = re.match(r'^(\w+)(?:\((\d+)(?:,(\d+))?\))?$', column.type)
+    if not match:
+        raise click.ClickException(
+            'Unsupported type {!r} of column {!r}'
+            .format(column.type, column.name))
+    base, _, scale = match.groups()
+    base = base.lower()
+    if column.type in enums:
+        return parse_enum(column.type, enums[column.type])
+    elif base in INTEGER_TYPES:
+        return int
+    elif base in BOOL_TYPES:
+        return parse_bool
+    elif base in NUMERIC_TYPES:
+        return parse_numeric(None if scale is None else int(scale))
+    elif base in FLOAT_TYPES:
+        return float
+    elif base in DATE_TYPES:
+        return date.fromisoformat
+    elif base in TIMESTAMP_TYPES:
+        return parse_timestamp
+    elif base in TEXT_TYPES:
+        return str
+    raise click.ClickException(
+        'Unsupported type {!r} of column {!r}'
+        .format(column.type, column.name))
+
+
+def column_type(column: DBMLColumn) -> Type[Union[int, float, str]]:
+    """
+    The sqlite_utils column type of a value of the column
+    """
+    base = re.sub(r'\(.*$', '', column.type).lower()
+    if base in INTEGER_TYPES or base in BOOL_TYPES:
+        return int
+    elif base in NUMERIC_TYPES or base in FLOAT_TYPES:
+        return float
+    return str
+
+
+def object_name(name1: str, name2: str, label: str) -> str:
+    """
+    The name PostgreSQL generates for a constraint or index
+
+    Like `makeObjectName`, the longer of the two parts is truncated
+    until the name fits in an identifier.
+    """
+    overhead = len(label) + 1 + (1 if name2 else 0)
+    chars1, chars2 = len(name1), len(name2)
+    while chars1 + chars2 > MAX_IDENTIFIER - overhead:
+        if chars1 > chars2:
+            chars1 -= 1
+        else:
+            chars2 -= 1
+    parts = [name1[:chars1]]
+    if name2:
+        parts.append(name2[:chars2])
+    parts.append(label)
+    return '_'.join(parts)
+
+
+def choose_name(name1: str, name2: str, label: str, used: Set[str]) -> str:
+    """
+    Like `ChooseRelationName`, number the label until the name is free
+    """
+    attempt = 0
+    while True:
+        name = object_name(
+            name1, name2, label + (str(attempt) if attempt else ''))
+        if name not in used:
+            used.add(name)
+            return name
+        attempt += 1
+
+
+# (index name, column names, unique)
+IndexPlan = Tuple[str, Tuple[str, ...], bool]
+
+
+def plan_indexes(schema: DBMLSchema) -> Dict[str, List[IndexPlan]]:
+    """
+    The non-primary-key indexes which `dbml2sql` creates in PostgreSQL,
+    under the names PostgreSQL chooses for them
+
+    Unique columns become `<table>_<column>_key` constraints when their
+    table is created, then the `indexes` of all tables are created as
+    `<table>_<columns>_idx`. As reflected by SQLAlchemy, the indexes of
+    a table are ordered by name.
+    """
+    used: Set[str] = {table.name for table in schema.tables}
+    plans: Dict[str, List[IndexPlan]] = {}
+    for table in schema.tables:
+        plan = plans.setdefault(table.name, [])
+        if table.primary_key:
+            choose_name(table.name, '', 'pkey', used)
+        for column in table.columns:
+            if column.unique and not column.pk:
+                plan.append((
+                    choose_name(table.name, column.name, 'key', used),
+                    (column.name,), True))
+    for table in schema.tables:
+        for index in table.indexes:
+            if index.pk:
+                continue
+            name = index.name
+            if name is None:
+                name = choose_name(
+                    table.name, '_'.join(index.columns), 'idx', used)
+            plans[table.name].append((name, index.columns, index.unique))
+    for plan in plans.values():
+        plan.sort()
+    return plans
+
+
+def table_sources(table_dir: str, name: str) -> List[str]:
+    """
+    `<name>.csv`, followed by the partitions in `<name>.d/` or `<name>/`
+    """
+    paths: List[str] = []
+    path = os.path.join(table_dir, name + '.csv')
+    if os.path.isfile(path):
+        paths.append(path)
+    for dirname in (name + '.d', name):
+        dirpath = os.path.join(table_dir, dirname)
+        if os.path.isdir(dirpath):
+            paths.extend(
+                os.path.join(dirpath, fn)
+                for fn in sorted(os.listdir(dirpath))
+                if fn.lower().endswith('.csv'))
+    return paths
+
+
+def iter_table_rows(
+    table: DBMLTable,
+    enums: Dict[str, Tuple[str, ...]],
+    paths: List[str],
+    null_str: str
+) -> Iterator[Dict[str, Any]]:
+    """
+    Rows of the CSV files of a table, as `COPY ... CSV HEADER` reads them
+
+    Cells are matched to the columns by position. The header is only
+    checked to catch CSV files written for another version of the
+    schema.
+    """
+    names = [column.name for column in table.columns]
+    converters = [column_converter(column, enums) for column in table.columns]
+    for path in paths:
+        with open(path, encoding='utf-8-sig', newline='') as fd:
+            reader = csv.reader(fd)
+            header = next(reader, None)
+            if header is None:
+                continue
+            if header != names:
+                raise click.ClickException(
+                    '{} does not have the columns of table {}: {}'
+                    .format(path, table.name, ', '.join(names)))
+            for row in reader:
+                if len(row) != len(names):
+                    raise click.ClickException(
+                        '{}:{}: expected {} cells, found {}'.format(
+                            path, reader.line_num, len(names), len(row)))
+                record: Dict[str, Any] = {}
+                for column, convert, value in zip(
+                    table.columns, converters, row
+                ):
+                    if value == null_str:
+                        if column.not_null:
+                            raise click.ClickException(
+                                '{}:{}: null value in column {!r}'.format(
+                                    path, reader.line_num, column.name))
+                        record[column.name] = None
+                        continue
+                    try:
+                        record[column.name] = convert(value)
+                    except ValueError as exc:
+                        raise click.ClickException(
+                            '{}:{}: column {!r}: {}'.format(
+                                path, reader.line_num, column.name, exc))
+                yield record
+
+
+def db_table(db: Database, name: str) -> Table:
+    tblobj = db[name]
+    if not isinstance(tblobj, Table):
+        raise click.ClickException(
+            "Output table must be a table, not a view"
+        )
+    return tblobj
+
+
+def create_table(db: Database, table: DBMLTable) -> Table:
+    pk = table.primary_key
+    tblobj = db_table(db, table.name)
+    tblobj.create(
+        {column.name: column_type(column) for column in table.columns},
+        pk=pk[0] if len(pk) == 1 else pk)
+    return tblobj
+
+
+def payload_last_update(payload_dir: str) -> datetime:
+    """
+    The commit time of the payload, or the latest modification time of
+    its files if it has uncommitted changes (see `export-sqls.sh`)
+    """
+    try:
+        status = subprocess.run(
+            ['git', 'status', '-s', '.'], cwd=payload_dir,
+            capture_output=True, encoding='UTF-8', check=True)
+        if not status.stdout.strip():
+            log = subprocess.run(
+                ['git', 'log', '-1', '--format=%ct', '.'], cwd=payload_dir,
+                capture_output=True, encoding='UTF-8', check=True)
+            return datetime.fromtimestamp(
+                int(log.stdout.strip()), timezone.utc)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        pass
+    mtime = max(
+        int(os.stat(os.path.join(dirpath, fn)).st_mtime)
+        for dirpath, _, filenames in os.walk(payload_dir)
+        for fn in filenames)
+    return datetime.fromtimestamp(mtime, timezone.utc)
+
+
+def sql_files(dirname: str) -> List[str]:
+    if not os.path.isdir(dirname):
+        return []
+    return [
+        os.path.join(dirname, fn)
+        for fn in sorted(os.listdir(dirname))
+        if fn.lower().endswith('.sql')
+    ]
+
+
+def build_sqlite_db(
+    db: Database,
+    schema: DBMLSchema,
+    table_dir: str,
+    derived_dir: str,
+    derived_csv_dir: Optional[str],
+    last_update: datetime,
+    null_str: str = 'NULL'
+) -> None:
+    """
+    Load the payload tables into an empty database the way the
+    PostgreSQL release path would produce it
+
+    Tables with CSV files are created by sqlite_utils from their rows,
+    as `db-to-sqlite` does; the others (e.g. the derived tables) are
+    created from the column types of the schema. The indexes are
+    created after the derived tables are populated.
+
+    A derived table is loaded from the partitions in `<table>.d/` of
+    `derived_csv_dir` (see `generate-derived-tables`) if there are any
+    and they are not older than the tables of `table_dir`, rather than
+    computed by its SQL file.
+    """
+    derived_sqls: Dict[str, str] = {
+        derived_sql_table(path): path for path in sql_files(derived_dir)}
+    if (
+        derived_csv_dir and os.path.isdir(derived_csv_dir) and
+        not derived_tables_current(table_dir, derived_csv_dir)
+    ):
+        click.echo(
+            'Warning: {} is older than the tables of {}, running {} '
+            'instead'.format(derived_csv_dir, table_dir, derived_dir),
+            err=True)
+        derived_csv_dir = None
+    for table in schema.tables:
+        if table.name in derived_sqls:
+            paths = []
+            if derived_csv_dir and os.path.isdir(derived_csv_dir):
+                paths = table_sources(derived_csv_dir, table.name)
+            if paths:
+                del derived_sqls[table.name]
+        else:
+            paths = table_sources(table_dir, table.name)
+        click.echo('{}: {} file(s)'.format(table.name, len(paths)), err=True)
+        rows = iter_table_rows(table, schema.enums, paths, null_str)
+        first = next(rows, None)
+        if first is None:
+            create_table(db, table)
+            continue
+        pk = table.primary_key
+        tblobj = db_table(db, table.name)
+        tblobj.insert_all(
+            itertools.chain([first], rows),
+            pk=pk[0] if len(pk) == 1 else list(pk),
+            batch_size=BATCH_SIZE)
+
+    db_table(db, 'last_update').insert(
+        {'scope': 'global', 'last_update': last_update})
+
+    for path in sorted(derived_sqls.values()):
+        click.echo(path, err=True)
+        with open(path, encoding='utf-8-sig') as fp:
+            db.conn.executescript(fp.read())
+
+    for table_name, indexes in plan_indexes(schema).items():
+        tblobj = db_table(db, table_name)
+        for name, columns, unique in indexes:
+            tblobj.create_index(list(columns), index_name=name, unique=unique)
+
+
+@cli.command()
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option(
+    '--schema',
+    type=click.Path(exists=True, dir_okay=False),
+    default='schema.dbml',
+    show_default=True)
+@click.option(
+    '--table-dir',
+    type=click.Path(exists=True, file_okay=False),
+    default='payload/tables',
+    show_default=True)
+@click.option(
+    '--derived-dir',
+    type=click.Path(file_okay=False),
+    default='derived_tables',
+    show_default=True)
+@click.option(
+    '--derived-csv-dir',
+    type=click.Path(file_okay=False),
+    default='build/derived',
+    show_default=True,
+    help='Derived tables computed by `generate-derived-tables`')
+@click.option(
+    '--views-dir',
+    type=click.Path(file_okay=False),
+    default='views',
+    show_default=True)
+@click.option(
+    '--payload-dir',
+    type=click.Path(exists=True, file_okay=False),
+    default='payload',
+    show_default=True,
+    help='Where the last_update time is taken from')
+@click.option(
+    '--page-size',
+    type=click.Choice([str(2 ** n) for n in range(9, 17)]),
+    default='8192',
+    show_default=True)
+@click.option(
+    '--cache-size',
+    help='SQLite page cache in MiB',
+    type=click.IntRange(min=1),
+    default=256,
+    show_default=True)
+def build_sqlite(
+    output: str,
+    schema: str,
+    table_dir: str,
+    derived_dir: str,
+    derived_csv_dir: str,
+    views_dir: str,
+    payload_dir: str,
+    page_size: str,
+    cache_size: int
+) -> None:
+    """
+    Build the release SQLite database directly from the payload CSVs
+
+    The PostgreSQL-free equivalent of `make devdb` followed by
+    `scripts/export-sqlite.sh`: the tables and indexes of SCHEMA are
+    created in SQLite, the CSV files under TABLE_DIR are loaded, and
+    the SQL files of DERIVED_DIR and VIEWS_DIR are run natively.
+    Use `compare-sqlite` to check the output against a release built
+    through PostgreSQL.
+    """
+    for dirname in ('constraints_pre-import', 'constraints_post-import'):
+        if sql_files(dirname):
+            click.echo(
+                'Warning: {} is PostgreSQL-specific and not applied'
+                .format(dirname), err=True)
+    with open(schema, encoding='utf-8-sig') as fp:
+        try:
+            dbml = parse_dbml(fp.read())
+        except ValueError as exc:
+            raise click.ClickException('{}: {}'.format(schema, exc))
+
+    load_path = output + '.load'
+    tmp_path = output + '.tmp'
+    for path in (load_path, tmp_path):
+        if os.path.exists(path):
+            os.unlink(path)
+    db = Database(load_path)
+    try:
+        begin_bulk_load(db, int(page_size), cache_size)
+        build_sqlite_db(
+            db, dbml, table_dir, derived_dir, derived_csv_dir,
+            payload_last_update(payload_dir))
+        for path in sql_files(views_dir):
+            click.echo(path, err=True)
+            with open(path, encoding='utf-8-sig') as fp:
+                db.conn.executescript(fp.read())
+        finish_bulk_load(db)
+        db.execute('VACUUM INTO ?', [tmp_path])
+    finally:
+        db.conn.close()
+        os.unlink(load_path)
+    os.replace(tmp_path, output)
+    click.echo(output)
@@ -0,0 +1,137 @@
+import sqlite3
+import click
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from ..cli import cli
+from .gen_derived_tables import APPLIED_TABLE
+
+# (name, declared type, position in the primary key)
+ColumnInfo = Tuple[str, str, int]
+# (column names, unique)
+IndexInfo = Tuple[Tuple[str, ...], bool]
+
+
+def list_objects(conn: sqlite3.Connection, type_: str) -> Dict[str, str]:
+    # the record of `generate-derived-tables --db-url` is not released
+    return {
+        name: sql or '' for name, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = ? AND name NOT LIKE 'sqlite_%' AND name != ?",
+            (type_, APPLIED_TABLE))
+    }
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[ColumnInfo]:
+    return [
+        (name, type_.upper(), pk) for _, name, type_, _, _, pk
+        in conn.execute('PRAGMA table_info([{}])'.format(table))
+    ]
+
+
+def table_indexes(
+    conn: sqlite3.Connection,
+    table: str
+) -> Dict[str, IndexInfo]:
+    indexes: Dict[str, IndexInfo] = {}
+    for _, name, unique, origin, _ in conn.execute(
+        'PRAGMA index_list([{}])'.format(table)
+    ):
+        if origin == 'pk':
+            # part of the table definition, compared with its columns
+            continue
+        columns = tuple(
+            col for _, _, col in conn.execute(
+                'PRAGMA index_info([{}])'.format(name)))
+        indexes[name] = (columns, bool(unique))
+    return indexes
+
+
+def table_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: List[str]
+) -> 'Counter[Tuple[Any, ...]]':
+    return Counter(conn.execute('SELECT {} FROM [{}]'.format(
+        ', '.join('[{}]'.format(col) for col in columns), table)))
+
+
+def compare_databases(
+    expected: sqlite3.Connection,
+    actual: sqlite3.Connection,
+    max_rows: int
+) -> List[str]:
+    """
+    Differences between two release databases
+
+    Tables are compared by their columns, indexes and rows; the order
+    of the tables and of their rows is not significant.
+    """
+    diffs: List[str] = []
+    expected_tables = list_objects(expected, 'table')
+    actual_tables = list_objects(actual, 'table')
+    for name in sorted(set(expected_tables) - set(actual_tables)):
+        diffs.append('missing table {}'.format(name))
+    for name in sorted(set(actual_tables) - set(expected_tables)):
+        diffs.append('unexpected table {}'.format(name))
+
+    for table in sorted(set(expected_tables) & set(actual_tables)):
+        expected_columns = table_columns(expected, table)
+        actual_columns = table_columns(actual, table)
+        if expected_columns != actual_columns:
+            diffs.append('{}: columns {} != {}'.format(
+                table, expected_columns, actual_columns))
+
+        expected_indexes = table_indexes(expected, table)
+        actual_indexes = table_indexes(actual, table)
+        for name in sorted(set(expected_indexes) | set(actual_indexes)):
+            if expected_indexes.get(name) != actual_indexes.get(name):
+                diffs.append('{}: index {} {} != {}'.format(
+                    table, name,
+                    expected_indexes.get(name), actual_indexes.get(name)))
+
+        actual_names = {col[0] for col in actual_columns}
+        columns = [
+            col[0] for col in expected_columns if col[0] in actual_names]
+        expected_rows = table_rows(expected, table, columns)
+        actual_rows = table_rows(actual, table, columns)
+        missing = expected_rows - actual_rows
+        unexpected = actual_rows - expected_rows
+        if missing or unexpected:
+            diffs.append(
+                '{}: {} row(s) missing, {} row(s) unexpected'.format(
+                    table, sum(missing.values()), sum(unexpected.values())))
+            for sign, rows in (('-', missing), ('+', unexpected)):
+                for row in sorted(rows, key=repr)[:max_rows]:
+                    diffs.append('  {} {!r}'.format(sign, row))
+
+    expected_views = list_objects(expected, 'view')
+    actual_views = list_objects(actual, 'view')
+    for name in sorted(set(expected_views) | set(actual_views)):
+        if expected_views.get(name) != actual_views.get(name):
+            diffs.append('view {} differs'.format(name))
+    return diffs
+
+
+@cli.command()
+@click.argument('expected', type=click.Path(exists=True, dir_okay=False))
+@click.argument('actual', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--max-rows',
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help='Number of differing rows shown per table')
+def compare_sqlite(expected: str, actual: str, max_rows: int) -> None:
+    """
+    Check a `build-sqlite` database against a release built through
+    PostgreSQL (`scripts/export-sqlite.sh`)
+    """
+    diffs = compare_databases(
+        sqlite3.connect(expected), sqlite3.connect(actual), max_rows)
+    for diff in diffs:
+        click.echo(diff, err=True)
+    if diffs:
+        click.echo('{} and {} differ'.format(expected, actual), err=True)
+        raise click.Abort()
+    click.echo('{} and {} are equivalent'.format(expected, actual))
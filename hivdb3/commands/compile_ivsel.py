@@ -0,0 +1,321 @@
+import os
+import click
+from typing import (
+    Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+)
+
+from ..cli import cli
+from ..utils.csvv import iter_csv, dump_csv, CSVReaderRow, CSVWriterRow
+from ..utils.mutations import MutationSet, GenePos
+
+from .gen_invitro_selection import (
+    gen_isolate_names, load_baseline, named_rows_to_table,
+    load_ivsel_worksheet, INVITRO_SELECTION_HEADERS
+)
+from .gen_ivsel_drugs import named_rows_to_drugs, IVSEL_DRUGS_HEADERS
+from .gen_ivsel_isolates import (
+    update_isolates, resolve_ivsel_rows, render_isolates, load_extracols,
+    IsolateUpdate, IVSEL_ISOLATES_HEADERS
+)
+from .gen_ref_amino_acid import load_consensus
+from .gen_drugs import (
+    load_drug_lookup, iter_drug_names, update_drug_lookup, dump_drugs,
+    DRUGS_WORKSHEET_COLUMNS
+)
+
+
+class WorksheetContext(NamedTuple):
+    """
+    Read-only inputs of `compile_worksheet`
+    """
+    renames: Dict[str, str]
+    refseq_mutmaps: Dict[str, MutationSet]
+    refmap: Mapping[GenePos, str]
+    # worksheet -> output CSV
+    invitro_selection_csvs: Mapping[str, str]
+    ivsel_drugs_csvs: Mapping[str, str]
+    resolve_isolates: bool
+
+
+class CompiledWorksheet(NamedTuple):
+    outputs: List[str]
+    drug_names: List[str]
+    isolate_updates: List[IsolateUpdate]
+
+
+def split_worksheets(worksheet_dir: str) -> Tuple[List[str], List[str]]:
+    """
+    CSV files of a directory -> (ivsel worksheets, other worksheets)
+    """
+    ivsel_worksheets: List[str] = []
+    other_worksheets: List[str] = []
+    for fn in sorted(os.listdir(worksheet_dir)):
+        if not fn.lower().endswith('.csv'):
+            continue
+        filename = os.path.join(worksheet_dir, fn)
+        if fn.endswith('-ivsel.csv'):
+            ivsel_worksheets.append(filename)
+        else:
+            other_worksheets.append(filename)
+    return ivsel_worksheets, other_worksheets
+
+
+def compile_worksheet(
+    filename: str,
+    context: WorksheetContext
+) -> CompiledWorksheet:
+    """
+    Read an ivsel worksheet once, write its invitro_selection and
+    invitro_selection_drugs outputs and resolve its isolates
+    """
+    rows = load_ivsel_worksheet(filename)
+    outputs: List[str] = []
+    isolate_updates: List[IsolateUpdate] = []
+    named_rows: List[CSVReaderRow] = list(
+        gen_isolate_names(rows, context.renames))
+
+    output_csv = context.invitro_selection_csvs.get(filename)
+    if output_csv:
+        dump_csv(
+            output_csv,
+            named_rows_to_table(named_rows),
+            headers=INVITRO_SELECTION_HEADERS,
+            only_if_changed=True
+        )
+        outputs.append(output_csv)
+
+    output_csv = context.ivsel_drugs_csvs.get(filename)
+    if output_csv:
+        dump_csv(
+            output_csv,
+            named_rows_to_drugs(named_rows),
+            headers=IVSEL_DRUGS_HEADERS,
+            only_if_changed=True
+        )
+        outputs.append(output_csv)
+
+    if context.resolve_isolates:
+        isolate_updates = list(resolve_ivsel_rows(
+            named_rows, context.refseq_mutmaps,
+            context.renames, context.refmap))
+    return CompiledWorksheet(
+        outputs, list(iter_drug_names(rows)), isolate_updates)
+
+
+# read-only inputs of the worker processes, set by `init_worker`
+_worker_context: Optional[WorksheetContext] = None
+
+
+def init_worker(context: WorksheetContext) -> None:
+    global _worker_context
+    _worker_context = context
+
+
+def compile_worksheet_in_worker(filename: str) -> CompiledWorksheet:
+    if _worker_context is None:
+        raise RuntimeError('Worker process is not initialized')
+    return compile_worksheet(filename, _worker_context)
+
+
+def compile_worksheets(
+    ivsel_worksheets: Sequence[str],
+    baseline_csv: Optional[str] = None,
+    consensus_csv: Optional[str] = None,
+    isolate_extracols_csv: Optional[str] = None,
+    invitro_selection_csvs: Mapping[str, str] = {},
+    ivsel_drugs_csvs: Mapping[str, str] = {},
+    ivsel_isolates_csv: Optional[str] = None,
+    drugs_csv: Optional[str] = None,
+    other_worksheets: Sequence[str] = (),
+    jobs: int = 1
+) -> None:
+    """
+    Compile ivsel worksheets into the requested derived tables
+
+    This is the single pass behind `compile-ivsel` and the
+    `generate-*` commands of each table: the baseline and the
+    consensus are loaded, and each worksheet is read and named, once.
+    `other_worksheets` only contribute to `drugs_csv`; so do the ivsel
+    worksheets when no other output is requested.
+
+    With `jobs` > 1, worksheets are compiled in a process pool. The
+    read-only inputs are sent once to each worker, and the results are
+    still merged in the order of `ivsel_worksheets`, so the output does
+    not depend on `jobs`.
+    """
+    if not (invitro_selection_csvs or ivsel_drugs_csvs or ivsel_isolates_csv):
+        other_worksheets = [*ivsel_worksheets, *other_worksheets]
+        ivsel_worksheets = []
+
+    drug_lookup: Dict[str, CSVWriterRow] = {}
+    if drugs_csv:
+        drug_lookup = load_drug_lookup(drugs_csv)
+        for filename in other_worksheets:
+            update_drug_lookup(drug_lookup, iter_drug_names(iter_csv(
+                filename, optional_columns=DRUGS_WORKSHEET_COLUMNS)))
+
+    isolates: Dict[str, CSVWriterRow] = {}
+    if ivsel_worksheets:
+        if baseline_csv is None:
+            raise ValueError('baseline_csv is required by ivsel worksheets')
+        if ivsel_isolates_csv and consensus_csv is None:
+            raise ValueError('consensus_csv is required by ivsel_isolates_csv')
+        baseline_seqs, renames = load_baseline(baseline_csv)
+        context = WorksheetContext(
+            renames,
+            baseline_seqs if ivsel_isolates_csv else {},
+            load_consensus(consensus_csv)
+            if ivsel_isolates_csv and consensus_csv else {},
+            invitro_selection_csvs,
+            ivsel_drugs_csvs,
+            bool(ivsel_isolates_csv)
+        )
+        extracols: Dict[str, CSVReaderRow] = {}
+        if ivsel_isolates_csv and isolate_extracols_csv:
+            extracols = load_extracols(isolate_extracols_csv)
+        for dirname in {
+            os.path.dirname(path)
+            for csvs in (invitro_selection_csvs, ivsel_drugs_csvs)
+            for path in csvs.values()
+        } - {''}:
+            os.makedirs(dirname, exist_ok=True)
+
+        results: Iterable[CompiledWorksheet]
+        if jobs > 1 and len(ivsel_worksheets) > 1:
+            # imported here to keep the start-up of serial runs cheap
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(
+                max_workers=min(jobs, len(ivsel_worksheets)),
+                initializer=init_worker,
+                initargs=(context,)
+            )
+            with executor:
+                results = list(executor.map(
+                    compile_worksheet_in_worker, ivsel_worksheets))
+        else:
+            results = (
+                compile_worksheet(filename, context)
+                for filename in ivsel_worksheets
+            )
+
+        for result in results:
+            for output_csv in result.outputs:
+                click.echo(output_csv)
+            update_drug_lookup(drug_lookup, result.drug_names)
+            for isolate_name, mutmap in result.isolate_updates:
+                update_isolates(isolates, isolate_name, mutmap, extracols)
+
+    if ivsel_isolates_csv:
+        click.echo(ivsel_isolates_csv)
+        dump_csv(
+            ivsel_isolates_csv,
+            render_isolates(isolates),
+            headers=IVSEL_ISOLATES_HEADERS,
+            only_if_changed=True
+        )
+
+    if drugs_csv:
+        click.echo(drugs_csv)
+        dump_drugs(drugs_csv, drug_lookup)
+
+
+def compile_worksheet_dir(
+    worksheet_dir: str,
+    baseline_csv: str,
+    consensus_csv: str,
+    isolate_extracols_csv: Optional[str],
+    invitro_selection_dir: str,
+    ivsel_drugs_dir: str,
+    ivsel_isolates_csv: str,
+    drugs_csv: str,
+    jobs: int = 1
+) -> None:
+    """
+    Compile every ivsel worksheet of a directory into all of its
+    derived tables
+    """
+    ivsel_worksheets, other_worksheets = split_worksheets(worksheet_dir)
+    compile_worksheets(
+        ivsel_worksheets,
+        baseline_csv,
+        consensus_csv,
+        isolate_extracols_csv,
+        invitro_selection_csvs={
+            filename: os.path.join(
+                invitro_selection_dir, os.path.basename(filename))
+            for filename in ivsel_worksheets
+        },
+        ivsel_drugs_csvs={
+            filename: os.path.join(
+                ivsel_drugs_dir,
+                os.path.basename(filename)[:-len('-ivsel.csv')] +
+                '-drugs.csv')
+            for filename in ivsel_worksheets
+        },
+        ivsel_isolates_csv=ivsel_isolates_csv,
+        drugs_csv=drugs_csv,
+        other_worksheets=other_worksheets,
+        jobs=jobs
+    )
+
+
+@cli.command()
+@click.argument(
+    'worksheet_dir',
+    type=click.Path(exists=True, dir_okay=True, file_okay=False))
+@click.option(
+    '--baseline-csv',
+    type=click.Path(exists=True, dir_okay=False),
+    required=True)
+@click.option(
+    '--consensus-csv',
+    type=click.Path(exists=True, dir_okay=False),
+    required=True)
+@click.option(
+    '--isolate-extracols-csv',
+    type=click.Path(exists=True, dir_okay=False),
+    required=False)
+@click.option(
+    '--invitro-selection-dir',
+    type=click.Path(file_okay=False),
+    required=True)
+@click.option(
+    '--ivsel-drugs-dir',
+    type=click.Path(file_okay=False),
+    required=True)
+@click.option(
+    '--ivsel-isolates-csv',
+    type=click.Path(dir_okay=False),
+    required=True)
+@click.option(
+    '--drugs-csv',
+    type=click.Path(dir_okay=False),
+    required=True)
+@click.option(
+    '-j', '--jobs',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of worksheets to compile in parallel')
+def compile_ivsel(
+    worksheet_dir: str,
+    baseline_csv: str,
+    consensus_csv: str,
+    isolate_extracols_csv: Optional[str],
+    invitro_selection_dir: str,
+    ivsel_drugs_dir: str,
+    ivsel_isolates_csv: str,
+    drugs_csv: str,
+    jobs: int
+) -> None:
+    compile_worksheet_dir(
+        worksheet_dir,
+        baseline_csv,
+        consensus_csv,
+        isolate_extracols_csv,
+        invitro_selection_dir,
+        ivsel_drugs_dir,
+        ivsel_isolates_csv,
+        drugs_csv,
+        jobs
+    )
@@ -0,0 +1,281 @@
+import json
+import itertools
+import click
+from pathlib import Path
+from sqlalchemy import (
+    Boolean, Column, Index, Integer, MetaData, Table, Text, and_, bindparam,
+    create_engine, select
+)
+from sqlalchemy.engine import Connection
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..utils.csvv import CSVReaderRow, CSVWriterRow
+
+from .gen_derived_tables import (
+    mut_key, derived_partition, file_stat, iter_derived_rows,
+    DerivedManifest, DerivedTables, FileStat, MANIFEST_FILE, APPLIED_TABLE,
+    IVSEL_COLUMNS, MUTATION_COLUMNS, DRM_COLUMNS, BASELINE_DRMS_TABLE,
+    BASELINE_DRMS_HEADERS, SELECTED_MUTATIONS_TABLE,
+    SELECTED_MUTATIONS_HEADERS
+)
+
+# (ref_name, isolate_name) of derived rows
+Pair = Tuple[Optional[str], Optional[str]]
+
+BATCH_SIZE = 10000
+
+DERIVED_HEADERS = (
+    (BASELINE_DRMS_TABLE, BASELINE_DRMS_HEADERS),
+    (SELECTED_MUTATIONS_TABLE, SELECTED_MUTATIONS_HEADERS)
+)
+
+
+def sql_table(
+    metadata: MetaData,
+    name: str,
+    columns: List[str],
+    temporary: bool = False
+) -> Table:
+    return Table(name, metadata, *(
+        Column(col, Integer) if col == 'position' else
+        Column(col, Boolean(create_constraint=False))
+        if col == 'is_baseline_drm' else
+        Column(col, Text)
+        for col in columns
+    ), prefixes=['TEMPORARY'] if temporary else [])
+
+
+def fetch_rows(conn: Connection, table: Table) -> List[CSVWriterRow]:
+    return [
+        dict(zip(table.c.keys(), row))
+        for row in conn.execute(select([table]))
+    ]
+
+
+def run_sql_files(conn: Connection, sql_paths: List[str]) -> None:
+    for path in sql_paths:
+        with open(path, encoding='utf-8-sig') as fp:
+            conn.exec_driver_sql(fp.read())
+
+
+def insert_rows(
+    conn: Connection,
+    table: Table,
+    rows: Iterable[Dict[str, object]]
+) -> None:
+    it = iter(rows)
+    while batch := list(itertools.islice(it, BATCH_SIZE)):
+        conn.execute(table.insert(), batch)
+
+
+def run_derived_sql(
+    sql_paths: List[str],
+    ivsel_rows: List[CSVReaderRow],
+    mutation_rows: Iterable[CSVReaderRow],
+    drm_rows: Iterable[CSVReaderRow],
+    url: str = 'sqlite://'
+) -> DerivedTables:
+    """
+    Compute the derived tables with the SQL version
+
+    The input and derived tables are created as temporary tables of the
+    database at `url`, which shadow its own tables of the same names
+    (e.g. in the devdb), and the transaction is rolled back: the
+    database is left as it was.
+    """
+    metadata = MetaData()
+    ivsel = sql_table(
+        metadata, 'invitro_selection', IVSEL_COLUMNS, temporary=True)
+    mutations = sql_table(
+        metadata, 'mutations', MUTATION_COLUMNS, temporary=True)
+    drms = sql_table(
+        metadata, 'resistance_mutations', DRM_COLUMNS, temporary=True)
+    Index('tmp_mutations_isolate_name', mutations.c.isolate_name)
+    Index('tmp_resistance_mutations_mut', *drms.c)
+    derived = [
+        sql_table(metadata, name, headers, temporary=True)
+        for name, headers in DERIVED_HEADERS
+    ]
+
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                metadata.create_all(conn, checkfirst=False)
+                insert_rows(conn, ivsel, (
+                    {name: row[name] for name in IVSEL_COLUMNS}
+                    for row in ivsel_rows))
+                insert_rows(conn, mutations, (
+                    dict(zip(MUTATION_COLUMNS, (
+                        row['isolate_name'], *mut_key(row))))
+                    for row in mutation_rows))
+                insert_rows(conn, drms, (
+                    dict(zip(DRM_COLUMNS, mut_key(row)))
+                    for row in drm_rows))
+                run_sql_files(conn, sql_paths)
+                return DerivedTables(
+                    *(fetch_rows(conn, table) for table in derived))
+            finally:
+                trans.rollback()
+    finally:
+        engine.dispose()
+
+
+def check_derived_db(
+    sql_paths: List[str],
+    url: str
+) -> Tuple[DerivedTables, DerivedTables]:
+    """
+    (derived tables computed by the SQL version from the tables of the
+    database at `url`, its own derived tables)
+
+    The SQL populates temporary derived tables, which shadow the
+    database's own ones, and the transaction is rolled back.
+    """
+    own = [
+        sql_table(MetaData(), name, headers)
+        for name, headers in DERIVED_HEADERS
+    ]
+    metadata = MetaData()
+    derived = [
+        sql_table(metadata, name, headers, temporary=True)
+        for name, headers in DERIVED_HEADERS
+    ]
+
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                actual = DerivedTables(
+                    *(fetch_rows(conn, table) for table in own))
+                metadata.create_all(conn, checkfirst=False)
+                run_sql_files(conn, sql_paths)
+                return DerivedTables(
+                    *(fetch_rows(conn, table) for table in derived)
+                ), actual
+            finally:
+                trans.rollback()
+    finally:
+        engine.dispose()
+
+
+def load_applied(
+    conn: Connection,
+    applied: Table
+) -> Dict[str, Tuple[List[FileStat], List[Pair]]]:
+    """
+    Partition -> (stats of its derived CSV files, its pairs), as last
+    applied to the database
+    """
+    records: Dict[str, Tuple[List[FileStat], List[Pair]]] = {}
+    for fn, stats, pairs in conn.execute(select([
+        applied.c.partition, applied.c.stats, applied.c.pairs
+    ])):
+        records[fn] = (
+            [(stat[0], stat[1], stat[2]) for stat in json.loads(stats)],
+            [(pair[0], pair[1]) for pair in json.loads(pairs)]
+        )
+    return records
+
+
+def apply_derived_tables(url: str, output_dir: str) -> Tuple[int, int]:
+    """
+    Bring the derived tables of an existing database up to date with
+    those of `output_dir`, return the numbers of replaced pairs and of
+    inserted rows
+
+    The partitions applied to the database are recorded in its table
+    `APPLIED_TABLE`, with the stats of their derived CSV files and
+    their (ref_name, isolate_name) pairs, so that `output_dir` may have
+    been updated any number of times since, e.g. by `build`. In one
+    transaction, the rows of the pairs of the partitions whose CSV
+    files changed or were removed since are replaced by those of
+    `output_dir`, and the record is updated. Without a record, e.g. in
+    a database just loaded from `output_dir`, all rows are replaced.
+    """
+    manifest = DerivedManifest(Path(output_dir) / MANIFEST_FILE)
+    manifest.load()
+    if manifest.drms is None:
+        raise click.ClickException(
+            '{} has no complete derived tables'.format(output_dir))
+    metadata = MetaData()
+    applied = Table(
+        APPLIED_TABLE, metadata,
+        Column('partition', Text, primary_key=True),
+        Column('stats', Text),
+        Column('pairs', Text))
+    tables = [
+        sql_table(metadata, name, headers)
+        for name, headers in DERIVED_HEADERS
+    ]
+
+    engine = create_engine(url)
+    try:
+        with engine.begin() as conn:
+            applied.create(conn, checkfirst=True)
+            records = load_applied(conn, applied)
+            full = not records
+            # partition -> (stats, pairs) to record
+            changed: Dict[str, Tuple[List[FileStat], List[Pair]]] = {}
+            pairs: Set[Pair] = set()
+            for fn, (_, ivsel_rows) in sorted(manifest.ivsel.items()):
+                known = records.get(fn)
+                stats = [
+                    file_stat(
+                        Path(derived_partition(output_dir, name, fn)),
+                        known[0][idx] if known else None)
+                    for idx, (name, _) in enumerate(DERIVED_HEADERS)
+                ]
+                fn_pairs = sorted(
+                    {(ref, iso) for ref, iso, _ in ivsel_rows}, key=repr)
+                if known and (stats, fn_pairs) == known:
+                    continue
+                changed[fn] = (stats, fn_pairs)
+                if not known or [stat[2] for stat in stats] != [
+                    stat[2] for stat in known[0]
+                ]:
+                    pairs.update(fn_pairs)
+                    pairs.update(known[1] if known else [])
+            removed = sorted(set(records) - set(manifest.ivsel))
+            for fn in removed:
+                pairs.update(records[fn][1])
+
+            partitions = [
+                fn for fn, (_, ivsel_rows) in sorted(manifest.ivsel.items())
+                if any((ref, iso) in pairs for ref, iso, _ in ivsel_rows)
+            ]
+            inserted = 0
+            for table, (name, headers) in zip(tables, DERIVED_HEADERS):
+                if full:
+                    conn.execute(table.delete())
+                elif pairs:
+                    conn.execute(
+                        table.delete().where(and_(
+                            table.c.ref_name == bindparam('b_ref_name'),
+                            table.c.isolate_name ==
+                            bindparam('b_isolate_name'))),
+                        [{'b_ref_name': ref, 'b_isolate_name': iso}
+                         for ref, iso in sorted(pairs, key=repr)])
+                rows = [
+                    row for fn in partitions
+                    for row in iter_derived_rows(
+                        derived_partition(output_dir, name, fn), headers)
+                    if (row['ref_name'], row['isolate_name']) in pairs
+                ]
+                insert_rows(conn, table, rows)
+                inserted += len(rows)
+
+            if removed or changed:
+                conn.execute(applied.delete().where(
+                    applied.c.partition.in_(removed + sorted(changed))))
+            insert_rows(conn, applied, (
+                {'partition': fn,
+                 'stats': json.dumps(stats),
+                 'pairs': json.dumps(fn_pairs)}
+                for fn, (stats, fn_pairs) in sorted(changed.items())
+            ))
+    finally:
+        engine.dispose()
+    return len(pairs), inserted
@@ -0,0 +1,548 @@
+import os
+import re
+import csv
+import json
+import hashlib
+import click
+from pathlib import Path
+from collections import Counter
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+)
+
+from ..cli import cli
+from ..utils.cache import file_digest, source_digest
+from ..utils.csvv import (
+    iter_csv, iter_multiple_csvs, list_csvs, dump_csv, open_output,
+    CSVReaderRow, CSVWriterRow
+)
+
+# (gene, position, amino_acid)
+MutKey = Tuple[str, int, str]
+# (ref_name, isolate_name, baseline_isolate_name)
+IvselRow = Tuple[Optional[str], Optional[str], Optional[str]]
+# (st_mtime_ns, st_size, digest)
+FileStat = Tuple[int, int, str]
+
+MANIFEST_FILE = '.derived-manifest.json'
+# partitions applied to a database by `generate-derived-tables --db-url`
+APPLIED_TABLE = 'derived_tables_applied'
+
+IVSEL_COLUMNS = ['ref_name', 'isolate_name', 'baseline_isolate_name']
+MUTATION_COLUMNS = ['isolate_name', 'gene', 'position', 'amino_acid']
+DRM_COLUMNS = ['gene', 'position', 'amino_acid']
+
+BASELINE_DRMS_TABLE = 'invitro_selection_baseline_drms'
+BASELINE_DRMS_HEADERS = [
+    'ref_name', 'isolate_name', 'gene', 'position', 'amino_acid'
+]
+SELECTED_MUTATIONS_TABLE = 'invitro_selected_mutations'
+SELECTED_MUTATIONS_HEADERS = [
+    'ref_name', 'isolate_name', 'gene', 'position', 'amino_acid',
+    'is_baseline_drm'
+]
+DERIVED_TABLES = (BASELINE_DRMS_TABLE, SELECTED_MUTATIONS_TABLE)
+
+
+class DerivedTables(NamedTuple):
+    baseline_drms: List[CSVWriterRow]
+    selected_mutations: List[CSVWriterRow]
+
+
+def mut_key(row: CSVReaderRow) -> MutKey:
+    return (
+        row['gene'] or '',
+        int(row['position'] or 0),
+        row['amino_acid'] or ''
+    )
+
+
+def load_drms(rows: Iterable[CSVReaderRow]) -> Set[MutKey]:
+    return {mut_key(row) for row in rows}
+
+
+def load_mutations(
+    rows: Iterable[CSVReaderRow],
+    isolate_names: Set[str]
+) -> Dict[str, List[MutKey]]:
+    """
+    Mutations of the given isolates, in the order of `rows`
+    """
+    mutations: Dict[str, List[MutKey]] = {}
+    for row in rows:
+        name = row['isolate_name']
+        if name in isolate_names:
+            mutations.setdefault(name, []).append(mut_key(row))
+    return mutations
+
+
+def ivsel_isolate_names(ivsel_rows: Iterable[CSVReaderRow]) -> Set[str]:
+    return {
+        name for iv in ivsel_rows
+        for col in ('isolate_name', 'baseline_isolate_name')
+        if (name := iv[col]) is not None
+    }
+
+
+def compute_derived_tables(
+    ivsel_rows: Iterable[CSVReaderRow],
+    mutations: Dict[str, List[MutKey]],
+    drms: Set[MutKey]
+) -> DerivedTables:
+    """
+    Compute `derived_tables/*.sql` for some in vitro selections
+
+    `mutations` must contain the mutations of their isolates and
+    baseline isolates (see `load_mutations`).
+
+    For each in vitro selection, a mutation of its baseline isolate is
+    a baseline DRM if it is a DRM. A mutation of the selected isolate
+    is kept unless it is a baseline mutation which is not a DRM; it is
+    flagged `is_baseline_drm` if it is a baseline DRM.
+    """
+    baseline_sets: Dict[str, Set[MutKey]] = {}
+
+    result = DerivedTables([], [])
+    for iv in ivsel_rows:
+        ref_name = iv['ref_name']
+        isolate_name = iv['isolate_name']
+        baseline_name = iv['baseline_isolate_name']
+        baseline: Set[MutKey] = set()
+        if baseline_name is not None:
+            if baseline_name not in baseline_sets:
+                baseline_sets[baseline_name] = set(
+                    mutations.get(baseline_name, []))
+            baseline = baseline_sets[baseline_name]
+            for gene, pos, aa in mutations.get(baseline_name, []):
+                if (gene, pos, aa) in drms:
+                    result.baseline_drms.append({
+                        'ref_name': ref_name,
+                        'isolate_name': isolate_name,
+                        'gene': gene,
+                        'position': pos,
+                        'amino_acid': aa
+                    })
+        for gene, pos, aa in mutations.get(isolate_name or '', []):
+            is_drm = (gene, pos, aa) in drms
+            is_baseline = (gene, pos, aa) in baseline
+            if is_baseline and not is_drm:
+                continue
+            result.selected_mutations.append({
+                'ref_name': ref_name,
+                'isolate_name': isolate_name,
+                'gene': gene,
+                'position': pos,
+                'amino_acid': aa,
+                'is_baseline_drm': is_baseline and is_drm
+            })
+    return result
+
+
+def derived_sql_table(sql_path: str) -> str:
+    """
+    `derived_tables/02_invitro_selected_mutations.sql` populates table
+    `invitro_selected_mutations`
+    """
+    return re.sub(r'^\d+_', '', os.path.basename(sql_path)[:-len('.sql')])
+
+
+def diff_rows(
+    table: str,
+    expected: List[CSVWriterRow],
+    actual: List[CSVWriterRow]
+) -> Iterator[str]:
+    def counter(rows: List[CSVWriterRow]) -> 'Counter[Tuple[object, ...]]':
+        return Counter(tuple(row.values()) for row in rows)
+    missing = counter(expected) - counter(actual)
+    unexpected = counter(actual) - counter(expected)
+    for row in sorted(missing, key=repr):
+        yield '{}: missing {!r}'.format(table, row)
+    for row in sorted(unexpected, key=repr):
+        yield '{}: unexpected {!r}'.format(table, row)
+
+
+class DerivedManifest:
+    """
+    The input partitions the derived tables of a directory were
+    computed from
+
+    For every partition of `invitro_selection` its (ref_name,
+    isolate_name, baseline_isolate_name) rows are kept, and for every
+    partition of `mutations.d` a digest of the mutations of each of its
+    isolates, so that the derived rows affected by a changed partition
+    can be found without reading the unchanged ones.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.drms: Optional[str] = None
+        self.code: Optional[str] = None
+        self.ivsel: Dict[str, Tuple[FileStat, List[IvselRow]]] = {}
+        self.mutations: Dict[str, Tuple[FileStat, Dict[str, str]]] = {}
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.drms = data['drms']
+            self.code = data['code']
+            self.ivsel = {
+                fn: ((stat[0], stat[1], stat[2]), [
+                    (row[0], row[1], row[2]) for row in rows
+                ])
+                for fn, (stat, rows) in data['ivsel'].items()
+            }
+            self.mutations = {
+                fn: ((stat[0], stat[1], stat[2]), digests)
+                for fn, (stat, digests) in data['mutations'].items()
+            }
+        except (FileNotFoundError, ValueError, KeyError, IndexError):
+            self.drms = self.code = None
+            self.ivsel = {}
+            self.mutations = {}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({
+                'drms': self.drms,
+                'code': self.code,
+                'ivsel': self.ivsel,
+                'mutations': self.mutations
+            }, fp)
+        os.replace(tmp_path, self.path)
+
+
+def file_stat(path: Path, known: Optional[FileStat]) -> FileStat:
+    """
+    The content digest of a file is only recomputed if its mtime or
+    size changed
+    """
+    stat = os.stat(path)
+    if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known
+    return (stat.st_mtime_ns, stat.st_size, file_digest(path))
+
+
+def isolate_digests(rows: Iterable[CSVReaderRow]) -> Dict[str, str]:
+    """
+    Digest of the mutations of each isolate, in the order of `rows`
+    """
+    hashes: Dict[str, 'hashlib._Hash'] = {}
+    for row in rows:
+        name = row['isolate_name'] or ''
+        if name not in hashes:
+            hashes[name] = hashlib.sha256()
+        hashes[name].update(repr(mut_key(row)).encode('UTF-8'))
+    return {name: sha.hexdigest() for name, sha in hashes.items()}
+
+
+def derived_partition(output_dir: str, table: str, fn: str) -> str:
+    return os.path.join(output_dir, table + '.d', fn)
+
+
+def dump_derived_table(
+    output_csv: str,
+    rows: List[CSVWriterRow],
+    headers: List[str]
+) -> None:
+    if rows:
+        dump_csv(output_csv, rows, headers=headers, only_if_changed=True)
+        return
+    # dump_csv writes nothing for no records; an empty partition still
+    # has to replace the previous one
+    with open_output(output_csv, 'utf-8', only_if_changed=True) as fd:
+        csv.writer(fd).writerow(headers)
+
+
+def update_derived_tables(
+    table_dir: str,
+    output_dir: str,
+    incremental: bool = True
+) -> List[str]:
+    """
+    Update the derived tables of `output_dir`, return the recomputed
+    partitions of `invitro_selection`
+
+    The derived tables are partitioned like `invitro_selection`, as
+    `<table>.d/<partition>.csv`. Only the partitions are recomputed
+    which changed, or which reference an isolate whose mutations
+    changed as isolate or baseline isolate; only the `mutations.d`
+    partitions with their isolates are read. Everything is
+    recomputed if `incremental` is false, or `resistance_mutations.csv`
+    or this code changed.
+    """
+    ivsel_dir = Path(table_dir) / 'invitro_selection'
+    mutations_dir = Path(table_dir) / 'mutations.d'
+    drms_csv = Path(table_dir) / 'resistance_mutations.csv'
+    manifest = DerivedManifest(Path(output_dir) / MANIFEST_FILE)
+    drms_digest = file_digest(drms_csv)
+    code = source_digest(__name__)
+    if incremental:
+        manifest.load()
+        if manifest.drms != drms_digest or manifest.code != code:
+            manifest = DerivedManifest(manifest.path)
+    # a partially updated directory is never mistaken for a complete one
+    if os.path.exists(manifest.path):
+        os.unlink(manifest.path)
+
+    ivsel_paths = {path.name: path for path in list_csvs(ivsel_dir)}
+    recompute: Set[str] = set()
+    for fn, path in ivsel_paths.items():
+        known = manifest.ivsel.get(fn)
+        stat = file_stat(path, known[0] if known else None)
+        if known and known[0][2] == stat[2] and all(
+            os.path.exists(derived_partition(output_dir, table, fn))
+            for table in DERIVED_TABLES
+        ):
+            manifest.ivsel[fn] = (stat, known[1])
+            continue
+        recompute.add(fn)
+        manifest.ivsel[fn] = (stat, [
+            (row['ref_name'], row['isolate_name'],
+             row['baseline_isolate_name'])
+            for row in iter_csv(path, columns=IVSEL_COLUMNS)
+        ])
+    removed = set(manifest.ivsel) - set(ivsel_paths)
+    for fn in removed:
+        del manifest.ivsel[fn]
+
+    # isolates whose mutations changed
+    touched: Set[str] = set()
+    mutation_paths = {path.name: path for path in list_csvs(mutations_dir)}
+    for fn in set(manifest.mutations) - set(mutation_paths):
+        touched.update(manifest.mutations.pop(fn)[1])
+    for fn, path in mutation_paths.items():
+        known_digests = manifest.mutations.get(fn)
+        stat = file_stat(path, known_digests[0] if known_digests else None)
+        if known_digests and known_digests[0][2] == stat[2]:
+            manifest.mutations[fn] = (stat, known_digests[1])
+            continue
+        digests = isolate_digests(
+            iter_csv(path, columns=MUTATION_COLUMNS))
+        old_digests = known_digests[1] if known_digests else {}
+        touched.update(
+            name for name in set(digests) | set(old_digests)
+            if digests.get(name) != old_digests.get(name))
+        manifest.mutations[fn] = (stat, digests)
+
+    for fn, (_, rows) in manifest.ivsel.items():
+        if any(iso in touched or baseline in touched
+               for _, iso, baseline in rows):
+            recompute.add(fn)
+
+    ivsel_rows: Dict[str, List[CSVReaderRow]] = {
+        fn: [dict(zip(IVSEL_COLUMNS, row)) for row in manifest.ivsel[fn][1]]
+        for fn in sorted(recompute)
+    }
+    needed = ivsel_isolate_names(
+        row for rows in ivsel_rows.values() for row in rows)
+    mutations = load_mutations(
+        (
+            row for fn, (_, digests) in sorted(manifest.mutations.items())
+            if needed.intersection(digests)
+            for row in iter_csv(
+                mutation_paths[fn], columns=MUTATION_COLUMNS)
+        ),
+        needed
+    )
+    drms = load_drms(iter_csv(drms_csv, columns=DRM_COLUMNS))
+
+    for table in DERIVED_TABLES:
+        os.makedirs(os.path.join(output_dir, table + '.d'), exist_ok=True)
+    for fn, partition_rows in ivsel_rows.items():
+        derived = compute_derived_tables(partition_rows, mutations, drms)
+        for table, table_rows, headers in (
+            (BASELINE_DRMS_TABLE, derived.baseline_drms,
+             BASELINE_DRMS_HEADERS),
+            (SELECTED_MUTATIONS_TABLE, derived.selected_mutations,
+             SELECTED_MUTATIONS_HEADERS)
+        ):
+            output_csv = derived_partition(output_dir, table, fn)
+            click.echo(output_csv)
+            dump_derived_table(output_csv, table_rows, headers)
+    for table in DERIVED_TABLES:
+        for path in list_csvs(os.path.join(output_dir, table + '.d')):
+            if path.name not in ivsel_paths:
+                # partition of a removed or a renamed worksheet
+                path.unlink()
+
+    manifest.drms = drms_digest
+    manifest.code = code
+    manifest.save()
+    return sorted(recompute)
+
+
+def derived_tables_current(table_dir: str, output_dir: str) -> bool:
+    """
+    Whether the derived tables of `output_dir` were completely computed
+    after the last change of their inputs under `table_dir`
+
+    The manifest is saved last by `update_derived_tables`, so it works
+    like the stamp of a Makefile rule: it must not be older than the
+    input tables, their directories (a partition may have been removed)
+    or this code. `scripts/export-sqls.sh` does the same with `find`.
+    """
+    try:
+        computed = os.stat(Path(output_dir) / MANIFEST_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    paths = [Path(__file__), Path(table_dir) / 'resistance_mutations.csv']
+    for dirname in ('invitro_selection', 'mutations.d'):
+        path = Path(table_dir) / dirname
+        if path.is_dir():
+            paths.extend([path, *list_csvs(path)])
+    return all(
+        os.stat(path).st_mtime_ns <= computed
+        for path in paths if path.exists()
+    )
+
+
+def typed_derived_row(row: CSVReaderRow) -> CSVWriterRow:
+    """
+    A row of a derived table CSV, typed like the computed ones
+    """
+    record: CSVWriterRow = dict(row)
+    record['position'] = int(row['position'] or 0)
+    if 'is_baseline_drm' in row:
+        record['is_baseline_drm'] = row['is_baseline_drm'] == 'True'
+    return record
+
+
+def iter_derived_rows(
+    partition_csv: str,
+    headers: List[str]
+) -> Iterator[CSVWriterRow]:
+    for row in iter_csv(partition_csv, columns=headers):
+        yield typed_derived_row(row)
+
+
+def load_derived_tables(output_dir: str) -> DerivedTables:
+    """
+    The derived tables of `output_dir`, typed like the computed ones
+    """
+    result = DerivedTables([], [])
+    for table, rows, headers in (
+        (BASELINE_DRMS_TABLE, result.baseline_drms, BASELINE_DRMS_HEADERS),
+        (SELECTED_MUTATIONS_TABLE, result.selected_mutations,
+         SELECTED_MUTATIONS_HEADERS)
+    ):
+        rows.extend(typed_derived_row(row) for row in iter_multiple_csvs(
+            os.path.join(output_dir, table + '.d'), columns=headers))
+    return result
+
+
+@cli.command()
+@click.option(
+    '--table-dir',
+    type=click.Path(exists=True, file_okay=False),
+    default='payload/tables',
+    show_default=True)
+@click.option(
+    '--output-dir',
+    type=click.Path(file_okay=False),
+    default='build/derived',
+    show_default=True)
+@click.option(
+    '--incremental',
+    is_flag=True,
+    help='Only recompute the partitions affected by changed inputs')
+@click.option(
+    '--db-url',
+    help='Also update the derived tables of this database, e.g. the '
+    'devdb: postgresql://postgres@localhost:6547/postgres')
+@click.option(
+    '--check',
+    type=click.Path(exists=True, file_okay=False),
+    help='Instead, compare the tables of OUTPUT_DIR with the SQL files '
+    'of this directory (e.g. derived_tables) run on the tables of '
+    'TABLE_DIR')
+@click.option(
+    '--check-url',
+    default='sqlite://',
+    show_default=True,
+    help='Database the SQL files are run on by --check, on temporary '
+    'tables, e.g. the devdb: postgresql://postgres@localhost:6547/postgres')
+@click.option(
+    '--check-db',
+    is_flag=True,
+    help='With --check, compare the derived tables of the CHECK_URL '
+    'database itself with the SQL files run on its own tables')
+def generate_derived_tables(
+    table_dir: str,
+    output_dir: str,
+    incremental: bool,
+    db_url: Optional[str],
+    check: Optional[str],
+    check_url: str,
+    check_db: bool
+) -> None:
+    """
+    Compute the derived tables as CSV files
+
+    `scripts/export-sqls.sh` and `build-sqlite` load the partitions of
+    `<table>.d/` of OUTPUT_DIR instead of running
+    `derived_tables/NN_<table>.sql`.
+
+    With --incremental, the work is done per partition of
+    invitro_selection: a changed partition, or one referencing an
+    isolate with changed mutations, is recomputed as a whole. With
+    --db-url, the database is then brought up to date with OUTPUT_DIR
+    instead of being rebuilt: the rows of the (ref_name, isolate_name)
+    pairs of the partitions which changed since it was last updated
+    (see `derived_db.apply_derived_tables`) are replaced in one
+    transaction. Its other tables are not updated.
+    """
+    if not check:
+        recomputed = update_derived_tables(table_dir, output_dir, incremental)
+        click.echo(
+            '{} partition(s) of invitro_selection recomputed'
+            .format(len(recomputed)), err=True)
+        if db_url:
+            # imported here, so that `build` does not load SQLAlchemy
+            from .derived_db import apply_derived_tables
+            pairs, inserted = apply_derived_tables(db_url, output_dir)
+            click.echo(
+                '{} derived row(s) inserted for {} pair(s)'
+                .format(inserted, pairs), err=True)
+        return
+
+    sql_paths = sorted(
+        os.path.join(check, fn) for fn in os.listdir(check)
+        if fn.endswith('.sql') and derived_sql_table(fn) in DERIVED_TABLES)
+    from .derived_db import run_derived_sql, check_derived_db
+    if check_db:
+        expected, actual = check_derived_db(sql_paths, check_url)
+    else:
+        if not derived_tables_current(table_dir, output_dir):
+            raise click.ClickException(
+                '{} is older than the tables of {}, run '
+                '`generate-derived-tables` first'
+                .format(output_dir, table_dir))
+        expected = run_derived_sql(
+            sql_paths,
+            list(iter_multiple_csvs(
+                os.path.join(table_dir, 'invitro_selection'),
+                columns=IVSEL_COLUMNS)),
+            iter_multiple_csvs(
+                os.path.join(table_dir, 'mutations.d'),
+                columns=MUTATION_COLUMNS),
+            iter_csv(
+                os.path.join(table_dir, 'resistance_mutations.csv'),
+                columns=DRM_COLUMNS),
+            check_url
+        )
+        actual = load_derived_tables(output_dir)
+    diffs = list(diff_rows(
+        BASELINE_DRMS_TABLE, expected.baseline_drms, actual.baseline_drms
+    )) + list(diff_rows(
+        SELECTED_MUTATIONS_TABLE,
+        expected.selected_mutations, actual.selected_mutations))
+    for diff in diffs:
+        click.echo(diff, err=True)
+    if diffs:
+        raise click.ClickException(
+            '{} row(s) differ from the SQL version'.format(len(diffs)))
+    click.echo('{} and {} rows match the SQL version'.format(
+        len(actual.baseline_drms), len(actual.selected_mutations)))
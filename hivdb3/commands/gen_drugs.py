@@ -1,45 +1,84 @@
 import os
 import re
 import click
+from typing import Dict, Iterable, Iterator
+
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv
+from ..utils.csvv import (
+    load_csv, dump_csv, CSVReaderRow, CSVWriterRow
+)
 
+DRUGS_HEADERS = [
+    'drug_name',
+    'drug_class',
+    'approved',
+    'drug_full_name',
+    'fda_approval_date'
+]
 
-@cli.command()
-@click.argument(
-    'input_dir',
-    type=click.Path(exists=True, file_okay=False))
-@click.argument('output_csv', type=click.Path(dir_okay=False))
-def generate_drugs(input_dir: str, output_csv: str) -> None:
-    click.echo(output_csv)
-    drug_lookup = {}
+# columns read from the worksheets
+DRUGS_WORKSHEET_COLUMNS = ['Regimen']
+
+
+def load_drug_lookup(output_csv: str) -> Dict[str, CSVWriterRow]:
+    """
+    Existing drug records, so that curated columns are kept
+    """
+    if not os.path.exists(output_csv):
+        return {}
+    drugs = load_csv(
+        output_csv,
+        columns=DRUGS_HEADERS[:1],
+        optional_columns=DRUGS_HEADERS[1:]
+    )
+    return {str(drug['drug_name']): drug for drug in drugs}
 
-    if os.path.exists(output_csv):
-        drugs = load_csv(output_csv)
-        drug_lookup = {drug['drug_name']: drug for drug in drugs}
 
-    for filepath in os.listdir(input_dir):
-        if not filepath.lower().endswith('.csv'):
+def iter_drug_names(rows: Iterable[CSVReaderRow]) -> Iterator[str]:
+    for row in rows:
+        regimen = row.get('Regimen')
+        if not regimen:
             continue
-        for row in load_csv(os.path.join(input_dir, filepath)):
-            regimen = row.get('Regimen')
-            if not regimen:
-                continue
-            for drug_name in re.split(r'\s*\+\s*', regimen):
-                if drug_name and drug_name not in drug_lookup:
-                    drug_lookup[drug_name] = {'drug_name': drug_name}
+        for drug_name in re.split(r'\s*\+\s*', regimen):
+            if drug_name:
+                yield drug_name
+
 
+def update_drug_lookup(
+    drug_lookup: Dict[str, CSVWriterRow],
+    drug_names: Iterable[str]
+) -> None:
+    for drug_name in drug_names:
+        if drug_name not in drug_lookup:
+            drug_lookup[drug_name] = {'drug_name': drug_name}
+
+
+def dump_drugs(
+    output_csv: str,
+    drug_lookup: Dict[str, CSVWriterRow]
+) -> None:
     dump_csv(
         output_csv,
         sorted(
             drug_lookup.values(),
             key=lambda d: str(d['drug_name'])
         ),
-        [
-            'drug_name',
-            'drug_class',
-            'approved',
-            'drug_full_name',
-            'fda_approval_date'
-        ]
+        DRUGS_HEADERS,
+        only_if_changed=True
+    )
+
+
+@cli.command()
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True, file_okay=False))
+@click.argument('output_csv', type=click.Path(dir_okay=False))
+def generate_drugs(input_dir: str, output_csv: str) -> None:
+    # imported here since compile_ivsel depends on this module
+    from .compile_ivsel import compile_worksheets, split_worksheets
+    ivsel_worksheets, other_worksheets = split_worksheets(input_dir)
+    compile_worksheets(
+        ivsel_worksheets,
+        other_worksheets=other_worksheets,
+        drugs_csv=output_csv
     )
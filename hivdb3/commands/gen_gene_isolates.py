@@ -1,10 +1,46 @@
 import os
 import click
 
+from typing import Iterable, Iterator
+
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv
+from ..utils.csvv import iter_csv, dump_csv, CSVReaderRow, CSVWriterRow
 
 GENES = ['PR', 'RT', 'IN', 'CA']
+GENE_ISOLATES_HEADERS = ['isolate_name', 'gene', 'genbank_accn']
+GENE_ISOLATES_COLUMNS = ['IsolateName']
+GENE_ISOLATES_OPTIONAL_COLUMNS = ['CanonName', 'Genbank'] + [
+    f'{gene} Mutations' for gene in GENES
+]
+
+
+def row_to_gene_isolates(
+    idx: int,
+    row: CSVReaderRow
+) -> Iterator[CSVWriterRow]:
+    if row.get('CanonName'):
+        # skip synonyms
+        return
+    isoname = row.get('IsolateName')
+    if not isoname:
+        click.echo("'IsolateName' is missing at row {}"
+                   .format(idx + 2), err=True)
+        raise click.Abort()
+    for gene in GENES:
+        gene_muts = row.get(f'{gene} Mutations')
+        if gene_muts and gene_muts != 'NA':
+            yield {
+                'isolate_name': isoname,
+                'gene': gene,
+                'genbank_accn': row.get('Genbank') or None
+            }
+
+
+def worksheet_to_gene_isolates(
+    isolates: Iterable[CSVReaderRow]
+) -> Iterator[CSVWriterRow]:
+    for idx, row in enumerate(isolates):
+        yield from row_to_gene_isolates(idx, row)
 
 
 @cli.command()
@@ -18,27 +54,13 @@ def generate_gene_isolates(input_worksheet: str, output_csv: str) -> None:
     os.makedirs(os.path.dirname(output_csv), exist_ok=True)
     click.echo(output_csv)
 
-    isolates = load_csv(input_worksheet)
-    records = []
-    for idx, row in enumerate(isolates):
-        if row.get('CanonName'):
-            # skip synonyms
-            continue
-        isoname = row.get('IsolateName')
-        if not isoname:
-            click.echo("'IsolateName' is missing at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-        for gene in GENES:
-            gene_muts = row.get(f'{gene} Mutations')
-            if gene_muts and gene_muts != 'NA':
-                records.append({
-                    'isolate_name': isoname,
-                    'gene': gene,
-                    'genbank_accn': row.get('Genbank') or None
-                })
     dump_csv(
         output_csv,
-        records,
-        ['isolate_name', 'gene', 'genbank_accn']
+        worksheet_to_gene_isolates(iter_csv(
+            input_worksheet,
+            columns=GENE_ISOLATES_COLUMNS,
+            optional_columns=GENE_ISOLATES_OPTIONAL_COLUMNS
+        )),
+        GENE_ISOLATES_HEADERS,
+        only_if_changed=True
     )
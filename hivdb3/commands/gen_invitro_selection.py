@@ -1,19 +1,137 @@
 import re
 import click
-from typing import List, Iterable, Tuple, Dict, Optional, Set
+from typing import List, Iterable, Tuple, Dict, Optional
 
 from ..cli import cli
-from ..utils.mutations import load_mutations, GenePos
-from ..utils.csvv import load_csv, dump_csv, CSVReaderRow, CSVWriterRow
+from ..utils.mutations import load_mutations, MutationSet
+from ..utils.csvv import load_csv, CSVReaderRow, CSVWriterRow
+from ..utils.cache import default_cache
+from ..utils.schema import (
+    Schema, NotNull, OneOf, Matches, SameArity, validate_worksheet
+)
+
+INVITRO_SELECTION_HEADERS = [
+    'ref_name',
+    'isolate_name',
+    'baseline_isolate_name',
+    'cell_line',
+    'experiment',
+    'passage_cmp',
+    'passage',
+    'passage_unknown',
+    'cumulative_culture_time_cmp',
+    'cumulative_culture_time',
+    'cumulative_culture_time_unit',
+    'cumulative_culture_time_unknown',
+    'section'
+]
+
+# columns of the ivsel worksheets read by the ivsel-derived tables
+IVSEL_WORKSHEET_COLUMNS = [
+    'RefName',
+    'Cell line',
+    'Strain',
+    'Regimen',
+    'Experiment',
+    'Passage',
+    'Cumulative culture time',
+    'Concentration',
+    'BaselineRefSeq',
+    'Gene',
+    'Baseline mutations',
+    'Delta mutations',
+    'Source'
+]
+
+VALID_UNITS = {
+    'um': '\u00b5M',  # use micro symbol "µ" not greek letter "μ"
+    '\u03bcm': '\u00b5M',
+    '\u00b5m': '\u00b5M',
+    'pm': 'pM',
+    'nm': 'nM',
+    'ng/ml': 'ng/ml'
+}
+
+DOSAGE_PATTERN = r'^([=><~]?)\s*(\d+\.?\d*)(?:\s*-\s*(\d+\.?\d*))?\s*([^\d]+)$'
+
+# separator of drugs in 'Regimen' and of dosages in 'Concentration'
+REGIMEN_SEPARATOR = r'\s*\+\s*'
+
+IVSEL_SCHEMA = Schema('ivsel', (
+    *(NotNull(col) for col in (
+        'RefName',
+        'Strain',
+        'Gene',
+        'Passage',
+        'Cumulative culture time',
+        'BaselineRefSeq',
+        'Baseline mutations',
+        'Delta mutations'
+    )),
+    NotNull('Regimen', allow_empty=False),
+    NotNull('Concentration', allow_empty=False),
+    OneOf('Gene', ('CA', 'PR', 'RT', 'IN')),
+    Matches('Passage', r'(?i:unknown)|.*\d.*', 'passage'),
+    Matches('Regimen', r'.+', 'drug', REGIMEN_SEPARATOR),
+    Matches(
+        'Concentration',
+        r'(?i:unknown)|[=><~]?\s*\d+\.?\d*(?:\s*-\s*\d+\.?\d*)?\s*(?i:{})'
+        .format('|'.join(re.escape(unit) for unit in VALID_UNITS)),
+        'dosage',
+        REGIMEN_SEPARATOR
+    ),
+    SameArity(('Regimen', 'Concentration'), REGIMEN_SEPARATOR)
+))
+
+BASELINE_COLUMNS = ['IsolateName', 'CanonName'] + [
+    f'{gene} Mutations' for gene in ('CA', 'PR', 'RT', 'IN')
+]
 
 
 def load_baseline(baseline_csv: str) -> Tuple[
-    Dict[str, Dict[GenePos, Set[str]]],
+    Dict[str, MutationSet],
     Dict[str, str]
 ]:
-    lookup: Dict[str, Dict[GenePos, Set[str]]] = {}
+    """
+    Load baseline isolates, reusing the on-disk cache when the worksheet
+    is unchanged since the last invocation
+    """
+    return default_cache.cached(
+        'baseline',
+        [baseline_csv],
+        lambda: parse_baseline(baseline_csv),
+        modules=[__name__, load_mutations.__module__, load_csv.__module__],
+        memo=True
+    )
+
+
+def load_ivsel_worksheet(filename: str) -> List[CSVReaderRow]:
+    """
+    Load and validate an ivsel worksheet against `IVSEL_SCHEMA`
+    """
+    rows = load_csv(filename, cached=True, columns=IVSEL_WORKSHEET_COLUMNS)
+    validate_worksheet(filename, IVSEL_SCHEMA, rows)
+    return rows
+
+
+def required(row: CSVReaderRow, column: str) -> str:
+    """
+    Value of a column which `IVSEL_SCHEMA` guarantees to be non-empty
+    """
+    value = row[column]
+    if value is None:
+        raise RuntimeError(
+            '{!r} is empty, check IVSEL_SCHEMA'.format(column))
+    return value
+
+
+def parse_baseline(baseline_csv: str) -> Tuple[
+    Dict[str, MutationSet],
+    Dict[str, str]
+]:
+    lookup: Dict[str, MutationSet] = {}
     renames: Dict[str, str] = {}
-    rows = load_csv(baseline_csv)
+    rows = load_csv(baseline_csv, columns=BASELINE_COLUMNS)
     for idx, row in enumerate(rows):
         if row['IsolateName'] is None:
             click.echo("({}) 'IsolateName' is empty at row {}"
@@ -24,7 +142,7 @@ def load_baseline(baseline_csv: str) -> Tuple[
             continue
         iso_name = row['IsolateName']
         if iso_name not in lookup:
-            lookup[iso_name] = {}
+            lookup[iso_name] = MutationSet()
         for gene in ('CA', 'PR', 'RT', 'IN'):
             genemuts = row[f'{gene} Mutations']
             if genemuts is None:
@@ -86,11 +204,7 @@ def gen_isolate_names(
     essential_key_columns.reverse()
     for key, idx in keys.items():
         row = rows[idx]
-        if row['RefName'] is None:
-            click.echo(
-                "'RefName' is empty at row {}".format(idx + 2), err=True)
-            raise click.Abort()
-        prefix = 'ivsel:' + row['RefName'] + '|'
+        prefix = 'ivsel:' + required(row, 'RefName') + '|'
         yield {
             'IsolateName': prefix + '|'.join(key),
             **rows[idx]
@@ -138,36 +252,15 @@ def is_unknown(value: str) -> bool:
     return value.lower() == 'unknown'
 
 
-def worksheet_to_table(
-    rows: List[CSVReaderRow],
-    renames: Dict[str, str]
+def named_rows_to_table(
+    named_rows: Iterable[CSVReaderRow]
 ) -> Iterable[CSVWriterRow]:
-
-    for idx, row in enumerate(gen_isolate_names(rows, renames)):
-        if row['Strain'] is None:
-            click.echo("'Strain' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-
-        if row['Baseline mutations'] is None:
-            click.echo("'Baseline mutations' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-
-        if row['Gene'] is None:
-            click.echo("'Gene' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-
-        if row['Passage'] is None:
-            click.echo("'Passage' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-
-        if row['Cumulative culture time'] is None:
-            click.echo("'Cumulative culture time' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
+    """
+    Rows yielded by `gen_isolate_names` -> invitro_selection records
+    """
+    for row in named_rows:
+        passage = required(row, 'Passage')
+        culture_time = required(row, 'Cumulative culture time')
 
         # TODO: this one should be used when creating mutations table
         # baseline_mutmap: Dict[GenePos, Set[str]] = make_mutation_map(
@@ -180,23 +273,16 @@ def worksheet_to_table(
         yield {
             'ref_name': row['RefName'],
             'isolate_name': row['IsolateName'],
-            'baseline_isolate_name': row['Strain'],
+            'baseline_isolate_name': required(row, 'Strain'),
             'cell_line': row['Cell line'],
             'experiment': row['Experiment'],
-            'passage_cmp': get_value_cmp(row['Passage']),
-            'passage': get_positive_num(row['Passage']),
-            'passage_unknown': is_unknown(row['Passage']),
-            'cumulative_culture_time_cmp':
-            get_value_cmp(row['Cumulative culture time']),
-
-            'cumulative_culture_time':
-            get_positive_num(row['Cumulative culture time']),
-
-            'cumulative_culture_time_unit':
-            get_time_unit(row['Cumulative culture time']),
-
-            'cumulative_culture_time_unknown':
-            is_unknown(row['Cumulative culture time']),
+            'passage_cmp': get_value_cmp(passage),
+            'passage': get_positive_num(passage),
+            'passage_unknown': is_unknown(passage),
+            'cumulative_culture_time_cmp': get_value_cmp(culture_time),
+            'cumulative_culture_time': get_positive_num(culture_time),
+            'cumulative_culture_time_unit': get_time_unit(culture_time),
+            'cumulative_culture_time_unknown': is_unknown(culture_time),
 
             'section': row['Source']
         }
@@ -218,25 +304,10 @@ def generate_invitro_selection(
     output_csv: str,
     baseline_csv: str
 ) -> None:
-    click.echo(output_csv)
-    _, renames = load_baseline(baseline_csv)
-    rows = load_csv(input_worksheet)
-    dump_csv(
-        output_csv,
-        worksheet_to_table(rows, renames),
-        headers=[
-            'ref_name',
-            'isolate_name',
-            'baseline_isolate_name',
-            'cell_line',
-            'experiment',
-            'passage_cmp',
-            'passage',
-            'passage_unknown',
-            'cumulative_culture_time_cmp',
-            'cumulative_culture_time',
-            'cumulative_culture_time_unit',
-            'cumulative_culture_time_unknown',
-            'section'
-        ]
+    # imported here since compile_ivsel depends on this module
+    from .compile_ivsel import compile_worksheets
+    compile_worksheets(
+        [input_worksheet],
+        baseline_csv,
+        invitro_selection_csvs={input_worksheet: output_csv}
     )
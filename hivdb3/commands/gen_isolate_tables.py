@@ -0,0 +1,108 @@
+import os
+import click
+
+from typing import Iterable, Iterator, Set, Tuple
+
+from ..cli import cli
+from ..utils.csvv import (
+    iter_csv, dump_csv_partitions, CSVReaderRow, CSVWriterRow
+)
+
+from .gen_isolates import (
+    row_to_isolate, ISOLATES_HEADERS, ISOLATES_COLUMNS,
+    ISOLATES_OPTIONAL_COLUMNS
+)
+from .gen_gene_isolates import (
+    row_to_gene_isolates, GENE_ISOLATES_HEADERS, GENE_ISOLATES_COLUMNS,
+    GENE_ISOLATES_OPTIONAL_COLUMNS
+)
+from .gen_mutations import (
+    row_to_mutations, MUTATIONS_HEADERS, MUTATIONS_COLUMNS,
+    MUTATIONS_OPTIONAL_COLUMNS
+)
+
+ISOLATE_TABLES_COLUMNS = list(dict.fromkeys(
+    ISOLATES_COLUMNS + GENE_ISOLATES_COLUMNS + MUTATIONS_COLUMNS
+))
+ISOLATE_TABLES_OPTIONAL_COLUMNS = [
+    col for col in dict.fromkeys(
+        ISOLATES_OPTIONAL_COLUMNS +
+        GENE_ISOLATES_OPTIONAL_COLUMNS +
+        MUTATIONS_OPTIONAL_COLUMNS
+    )
+    if col not in ISOLATE_TABLES_COLUMNS
+]
+
+
+def worksheet_to_isolate_tables(
+    isolates: Iterable[CSVReaderRow]
+) -> Iterator[Tuple[str, CSVWriterRow]]:
+    """
+    Isolate worksheet rows -> (table, record) of isolates,
+    gene_isolates and mutations, in one pass
+    """
+    unique_isolates: Set[str] = set()
+    for idx, row in enumerate(isolates):
+        isolate = row_to_isolate(idx, row)
+        if isolate is None:
+            # synonym
+            continue
+        if isolate['isolate_name'] not in unique_isolates:
+            yield 'isolates', isolate
+            unique_isolates.add(isolate['isolate_name'])
+        for gene_isolate in row_to_gene_isolates(idx, row):
+            yield 'gene_isolates', gene_isolate
+        for mutation in row_to_mutations(row):
+            yield 'mutations', mutation
+
+
+def dump_isolate_tables(
+    input_worksheet: str,
+    isolates_csv: str,
+    gene_isolates_csv: str,
+    mutations_csv: str
+) -> None:
+    outputs = {
+        'isolates': (isolates_csv, ISOLATES_HEADERS),
+        'gene_isolates': (gene_isolates_csv, GENE_ISOLATES_HEADERS),
+        'mutations': (mutations_csv, MUTATIONS_HEADERS)
+    }
+    for output_csv, _ in outputs.values():
+        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+        click.echo(output_csv)
+
+    dump_csv_partitions(
+        worksheet_to_isolate_tables(iter_csv(
+            input_worksheet,
+            columns=ISOLATE_TABLES_COLUMNS,
+            optional_columns=ISOLATE_TABLES_OPTIONAL_COLUMNS
+        )),
+        outputs,
+        only_if_changed=True
+    )
+
+
+@cli.command()
+@click.argument(
+    'input_worksheet',
+    type=click.Path(exists=True, file_okay=True))
+@click.option(
+    '--isolates-csv',
+    type=click.Path(dir_okay=False),
+    required=True)
+@click.option(
+    '--gene-isolates-csv',
+    type=click.Path(dir_okay=False),
+    required=True)
+@click.option(
+    '--mutations-csv',
+    type=click.Path(dir_okay=False),
+    required=True)
+def generate_isolate_tables(
+    input_worksheet: str,
+    isolates_csv: str,
+    gene_isolates_csv: str,
+    mutations_csv: str
+) -> None:
+    dump_isolate_tables(
+        input_worksheet, isolates_csv, gene_isolates_csv, mutations_csv)
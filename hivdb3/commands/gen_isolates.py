@@ -1,10 +1,41 @@
 import os
 import click
 
+from typing import Iterable, Iterator, Optional, Set
+
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv
+from ..utils.csvv import iter_csv, dump_csv, CSVReaderRow, CSVWriterRow
 
 GENES = ['PR', 'RT', 'IN', 'CA']
+ISOLATES_HEADERS = ['isolate_name', 'subtype']
+ISOLATES_COLUMNS = ['IsolateName']
+ISOLATES_OPTIONAL_COLUMNS = ['CanonName', 'Subtype']
+
+
+def row_to_isolate(idx: int, row: CSVReaderRow) -> Optional[CSVWriterRow]:
+    if row.get('CanonName'):
+        # skip synonyms
+        return None
+    isoname = row.get('IsolateName')
+    if not isoname:
+        click.echo("'IsolateName' is missing at row {}"
+                   .format(idx + 2), err=True)
+        raise click.Abort()
+    return {
+        'isolate_name': isoname,
+        'subtype': row.get('Subtype')
+    }
+
+
+def worksheet_to_isolates(
+    isolates: Iterable[CSVReaderRow]
+) -> Iterator[CSVWriterRow]:
+    unique_isolates: Set[str] = set()
+    for idx, row in enumerate(isolates):
+        isolate = row_to_isolate(idx, row)
+        if isolate and isolate['isolate_name'] not in unique_isolates:
+            yield isolate
+            unique_isolates.add(isolate['isolate_name'])
 
 
 @cli.command()
@@ -18,27 +49,13 @@ def generate_isolates(input_worksheet: str, output_csv: str) -> None:
     os.makedirs(os.path.dirname(output_csv), exist_ok=True)
     click.echo(output_csv)
 
-    isolates = load_csv(input_worksheet)
-    records = []
-    unique_isolates = set()
-    for idx, row in enumerate(isolates):
-        if row.get('CanonName'):
-            # skip synonyms
-            continue
-        isoname = row.get('IsolateName')
-        if not isoname:
-            click.echo("'IsolateName' is missing at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-        subtype = row.get('Subtype')
-        if isoname not in unique_isolates:
-            records.append({
-                'isolate_name': isoname,
-                'subtype': subtype
-            })
-            unique_isolates.add(isoname)
     dump_csv(
         output_csv,
-        records,
-        ['isolate_name', 'subtype']
+        worksheet_to_isolates(iter_csv(
+            input_worksheet,
+            columns=ISOLATES_COLUMNS,
+            optional_columns=ISOLATES_OPTIONAL_COLUMNS
+        )),
+        ISOLATES_HEADERS,
+        only_if_changed=True
     )
@@ -1,20 +1,25 @@
-import os
 import re
 import click
 
+from typing import Dict, Iterable, Optional, Tuple
+
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv, CSVWriterRow
 
-from .gen_invitro_selection import gen_isolate_names, load_baseline
+from ..utils.csvv import CSVReaderRow, CSVWriterRow
+
+from .gen_invitro_selection import (
+    required, VALID_UNITS, DOSAGE_PATTERN, REGIMEN_SEPARATOR
+)
 
-VALID_UNITS = {
-    'um': '\u00b5M',  # use micro symbol "µ" not greek letter "μ"
-    '\u03bcm': '\u00b5M',
-    '\u00b5m': '\u00b5M',
-    'pm': 'pM',
-    'nm': 'nM',
-    'ng/ml': 'ng/ml'
-}
+IVSEL_DRUGS_HEADERS = [
+    'ref_name',
+    'isolate_name',
+    'drug_name',
+    'concentration_cmp',
+    'concentration',
+    'concentration_unit',
+    'concentration_unknown'
+]
 
 
 def norm_range(start: str, end: str) -> float:
@@ -32,67 +37,22 @@ def norm_unit(unit: str) -> str:
     return VALID_UNITS[lower]
 
 
-@cli.command()
-@click.argument(
-    'input_worksheet',
-    type=click.Path(exists=True, file_okay=True))
-@click.argument(
-    'output_csv',
-    type=click.Path(dir_okay=False))
-@click.option(
-    '--baseline-csv',
-    type=click.Path(exists=True, dir_okay=False),
-    required=True)
-def generate_ivsel_drugs(
-    input_worksheet: str,
-    output_csv: str,
-    baseline_csv: str
-) -> None:
-    _, renames = load_baseline(baseline_csv)
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    click.echo(output_csv)
-
-    # Load the data from the input worksheet using the csvv.load_csv() function
-    rows = load_csv(input_worksheet)
-    results = {}
-    # Process each row in the input worksheet
-    for idx, row in enumerate(gen_isolate_names(rows, renames)):
-        regimen = row.get('Regimen')
-        concentration = row.get('Concentration')
-        if not regimen:
-            click.echo("'Regimen' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
-        if not concentration:
-            click.echo("'Concentration' is empty at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
+def named_rows_to_drugs(
+    named_rows: Iterable[CSVReaderRow]
+) -> Iterable[CSVWriterRow]:
+    """
+    Rows yielded by `gen_isolate_names` -> invitro_selection_drugs records
+    """
+    results: Dict[Tuple[Optional[str], ...], CSVWriterRow] = {}
+    # Process each row in the input worksheet; the format of
+    # 'Regimen' and 'Concentration' is checked by IVSEL_SCHEMA
+    for row in named_rows:
         # Split the "Regimen" column into a list of drug names
-        drugs = re.split(r'\s*\+\s*', regimen)
-        dosages = re.split(r'\s*\+\s*', concentration)
-        if len(drugs) != len(dosages):
-            click.echo("The sizes of 'Regimen' and 'Concentration' "
-                       "are not the same at row {}"
-                       .format(idx + 2), err=True)
-            raise click.Abort()
+        drugs = re.split(REGIMEN_SEPARATOR, required(row, 'Regimen'))
+        dosages = re.split(REGIMEN_SEPARATOR, required(row, 'Concentration'))
         for drug, dosage in zip(drugs, dosages):
-            if not drug:
-                click.echo("A drug is empty in 'Regimen' of row {}"
-                           .format(idx + 2), err=True)
-                raise click.Abort()
-            if not dosage:
-                click.echo("A dosage is empty in 'Concentration' of row {}"
-                           .format(idx + 2), err=True)
-                raise click.Abort()
             is_unknown = dosage.lower() == 'unknown'
-            mat = re.match(
-                r'^([=><~]?)\s*(\d+\.?\d*)(?:\s*-\s*(\d+\.?\d*))?\s*([^\d]+)$',
-                dosage)
-
-            if not is_unknown and not mat:
-                click.echo('Invalid dosage format: {} at row {}'
-                           .format(dosage, idx + 2), err=True)
-                raise click.Abort()
+            mat = re.match(DOSAGE_PATTERN, dosage)
 
             dosage_results: CSVWriterRow = {
                 'concentration_cmp': None,
@@ -123,15 +83,29 @@ def generate_ivsel_drugs(
                 **dosage_results
             }
 
-    # Dump the processed data to the output CSV file
-    # using the csvv.dump_csv() function
-    headers = [
-        'ref_name',
-        'isolate_name',
-        'drug_name',
-        'concentration_cmp',
-        'concentration',
-        'concentration_unit',
-        'concentration_unknown'
-    ]
-    dump_csv(output_csv, results.values(), headers=headers)
+    return results.values()
+
+
+@cli.command()
+@click.argument(
+    'input_worksheet',
+    type=click.Path(exists=True, file_okay=True))
+@click.argument(
+    'output_csv',
+    type=click.Path(dir_okay=False))
+@click.option(
+    '--baseline-csv',
+    type=click.Path(exists=True, dir_okay=False),
+    required=True)
+def generate_ivsel_drugs(
+    input_worksheet: str,
+    output_csv: str,
+    baseline_csv: str
+) -> None:
+    # imported here since compile_ivsel depends on this module
+    from .compile_ivsel import compile_worksheets
+    compile_worksheets(
+        [input_worksheet],
+        baseline_csv,
+        ivsel_drugs_csvs={input_worksheet: output_csv}
+    )
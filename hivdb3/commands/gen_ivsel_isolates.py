@@ -1,115 +1,121 @@
-import os
 import click
-from typing import List, Iterable, Dict, Set
+from typing import (
+    Iterable, Iterator, Dict, Mapping, Optional, Set, Tuple
+)
 
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv, CSVReaderRow, CSVWriterRow
-from ..utils.mutations import load_mutations, dump_mutations, GenePos
+from ..utils.csvv import (
+    iter_csv, CSVReaderRow, CSVWriterRow
+)
+from ..utils.mutations import (
+    load_mutations, dump_mutations, MutationSet, GenePos
+)
 
-from .gen_invitro_selection import gen_isolate_names, load_baseline
-from .gen_ref_amino_acid import load_consensus
+from .gen_invitro_selection import required
+
+IsolateUpdate = Tuple[str, MutationSet]
+
+EXTRACOLS_COLUMNS = ['IsolateName']
+EXTRACOLS_OPTIONAL_COLUMNS = ['Subtype', 'Genbank']
+
+IVSEL_ISOLATES_HEADERS = [
+    'IsolateName',
+    'Subtype',
+    'Genbank',
+    'CA Mutations',
+    'PR Mutations',
+    'RT Mutations',
+    'IN Mutations'
+]
 
 
 def update_isolates(
     isolates: Dict[str, CSVWriterRow],
     isolate_name: str,
-    mutmap: Dict[GenePos, Set[str]],
+    mutmap: MutationSet,
     extracols: Dict[str, CSVReaderRow]
 ) -> None:
+    """
+    Merge `mutmap` into an isolate; serialization is left to
+    `render_isolates`, which only re-renders the genes marked dirty
+    """
     if isolate_name not in isolates:
         isolates[isolate_name] = {
-            '_mutmap': mutmap,
+            # an overlay so that later updates do not touch `mutmap`
+            '_mutmap': mutmap.derive(),
+            '_dirty': set(mutmap.genes()),
             **extracols.get(isolate_name, {
                 'IsolateName': isolate_name
-            }),
-            **dump_mutations(mutmap)
+            })
         }
     else:
-        old_mutmap: Dict[GenePos, Set[str]] = isolates[isolate_name]['_mutmap']
+        old_mutmap: MutationSet = isolates[isolate_name]['_mutmap']
         old_mutmap.update(mutmap)
-        isolates[isolate_name].update(
-            dump_mutations(old_mutmap)
-        )
+        isolates[isolate_name]['_dirty'].update(mutmap.genes())
+
+
+def render_isolates(
+    isolates: Dict[str, CSVWriterRow]
+) -> Iterator[CSVWriterRow]:
+    for isolate in isolates.values():
+        dirty: Set[str] = isolate['_dirty']
+        if dirty:
+            isolate.update(dump_mutations(isolate['_mutmap'], dirty))
+            dirty.clear()
+        yield isolate
 
 
-def ivsel_to_isolates(
-    filenames: List[str],
-    refseq_mutmaps: Dict[str, Dict[GenePos, Set[str]]],
+def resolve_ivsel_rows(
+    named_rows: Iterable[CSVReaderRow],
+    refseq_mutmaps: Dict[str, MutationSet],
     renames: Dict[str, str],
-    refmap: Dict[GenePos, str],
-    extracols: Dict[str, CSVReaderRow]
-) -> Iterable[CSVWriterRow]:
-    isolates: Dict[str, CSVWriterRow] = {}
-
-    for filename in filenames:
-        rows: List[CSVReaderRow] = load_csv(filename)
-        for idx, row in enumerate(gen_isolate_names(rows, renames)):
-            if row['IsolateName'] is None:
-                raise RuntimeError(
-                    "'IsolateName' is empty, "
-                    "check function 'gen_isolate_names'"
-                )
-
-            if row['BaselineRefSeq'] is None:
-                click.echo("({}) 'BaselineRefSeq' is empty at row {}"
-                           .format(filename, idx + 2), err=True)
-                raise click.Abort()
-
-            if row['Strain'] is None:
-                click.echo("({}) 'Strain' is empty at row {}"
-                           .format(filename, idx + 2), err=True)
-                raise click.Abort()
-
-            if row['Gene'] is None:
-                click.echo("({}) 'Gene' is empty at row {}"
-                           .format(filename, idx + 2), err=True)
-                raise click.Abort()
-
-            if row['Baseline mutations'] is None:
-                click.echo("({}) 'Baseline mutations' is empty at row {}"
-                           .format(filename, idx + 2), err=True)
-                raise click.Abort()
-
-            if row['Delta mutations'] is None:
-                click.echo("({}) 'Delta mutations' is empty at row {}"
-                           .format(filename, idx + 2), err=True)
-                raise click.Abort()
-
-            refseq_name = row['BaselineRefSeq']
-            baseline_name = row['Strain']
-
-            if refseq_name in renames:
-                refseq_name = renames[refseq_name]
-
-            if baseline_name in renames:
-                baseline_name = renames[baseline_name]
-
-            refseq_mutmap = refseq_mutmaps.get(refseq_name, {})
-            baseline_mutmap = load_mutations(
-                row['Baseline mutations'],
-                default_gene=row['Gene'],
-                baseline_mutmap=refseq_mutmap,
-                refmap=refmap
-            )
+    refmap: Mapping[GenePos, str]
+) -> Iterator[IsolateUpdate]:
+    """
+    Resolve the rows (yielded by `gen_isolate_names`) of one ivsel
+    worksheet into (isolate name, mutation map) updates, in row order
+
+    Depends only on read-only inputs, so worksheets can be resolved
+    independently and merged later with `update_isolates`.
+    """
+    for row in named_rows:
+        refseq_name = required(row, 'BaselineRefSeq')
+        baseline_name = required(row, 'Strain')
+        gene = required(row, 'Gene')
+
+        if refseq_name in renames:
+            refseq_name = renames[refseq_name]
+
+        if baseline_name in renames:
+            baseline_name = renames[baseline_name]
+
+        refseq_mutmap = refseq_mutmaps.get(refseq_name, MutationSet())
+        baseline_mutmap = load_mutations(
+            required(row, 'Baseline mutations'),
+            default_gene=gene,
+            baseline_mutmap=refseq_mutmap,
+            refmap=refmap
+        )
 
-            if baseline_name not in refseq_mutmaps:
-                update_isolates(
-                    isolates, baseline_name, baseline_mutmap, extracols)
+        if baseline_name not in refseq_mutmaps:
+            yield baseline_name, baseline_mutmap
 
-            delta_mutmap = load_mutations(
-                row['Delta mutations'],
-                default_gene=row['Gene'],
-                baseline_mutmap=baseline_mutmap,
-                refmap=refmap
-            )
-            update_isolates(
-                isolates, row['IsolateName'], delta_mutmap, extracols)
-    return isolates.values()
+        delta_mutmap = load_mutations(
+            required(row, 'Delta mutations'),
+            default_gene=gene,
+            baseline_mutmap=baseline_mutmap,
+            refmap=refmap
+        )
+        yield required(row, 'IsolateName'), delta_mutmap
 
 
 def load_extracols(filename: str) -> Dict[str, CSVReaderRow]:
     extracols: Dict[str, CSVReaderRow] = {}
-    for row in load_csv(filename):
+    for row in iter_csv(
+        filename,
+        columns=EXTRACOLS_COLUMNS,
+        optional_columns=EXTRACOLS_OPTIONAL_COLUMNS
+    ):
         if row['IsolateName'] is None:
             raise RuntimeError(
                 "'IsolateName' in {} can not be empty"
@@ -138,33 +144,28 @@ def load_extracols(filename: str) -> Dict[str, CSVReaderRow]:
     '--isolate-extracols-csv',
     type=click.Path(exists=True, dir_okay=False),
     required=False)
+@click.option(
+    '-j', '--jobs',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of worksheets to resolve in parallel')
 def generate_ivsel_isolates(
     worksheet_dir: str,
     output_csv: str,
     baseline_csv: str,
     consensus_csv: str,
-    isolate_extracols_csv: str
+    isolate_extracols_csv: Optional[str],
+    jobs: int
 ) -> None:
-    click.echo(output_csv)
-    baseline_seqs, renames = load_baseline(baseline_csv)
-    refmap = load_consensus(consensus_csv)
-    extracols: Dict[str, CSVReaderRow] = load_extracols(isolate_extracols_csv)
-    filenames = [
-        os.path.join(worksheet_dir, fn)
-        for fn in os.listdir(worksheet_dir)
-        if fn.endswith('-ivsel.csv')
-    ]
-    dump_csv(
-        output_csv,
-        ivsel_to_isolates(filenames, baseline_seqs,
-                          renames, refmap, extracols),
-        headers=[
-            'IsolateName',
-            'Subtype',
-            'Genbank',
-            'CA Mutations',
-            'PR Mutations',
-            'RT Mutations',
-            'IN Mutations'
-        ]
+    # imported here since compile_ivsel depends on this module
+    from .compile_ivsel import compile_worksheets, split_worksheets
+    ivsel_worksheets, _ = split_worksheets(worksheet_dir)
+    compile_worksheets(
+        ivsel_worksheets,
+        baseline_csv,
+        consensus_csv,
+        isolate_extracols_csv,
+        ivsel_isolates_csv=output_csv,
+        jobs=jobs
     )
@@ -2,11 +2,50 @@ import os
 import re
 import click
 
+from typing import Iterable, Iterator
+
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv
+from ..utils.csvv import iter_csv, dump_csv, CSVReaderRow, CSVWriterRow
 from ..utils.mutations import load_mutations
 
 GENES = ['PR', 'RT', 'IN', 'CA']
+MUTATIONS_HEADERS = ['isolate_name', 'gene', 'position', 'amino_acid']
+MUTATIONS_COLUMNS = ['IsolateName']
+MUTATIONS_OPTIONAL_COLUMNS = ['CanonName'] + [
+    f'{gene} Mutations' for gene in GENES
+]
+
+
+def row_to_mutations(row: CSVReaderRow) -> Iterator[CSVWriterRow]:
+    if row.get('CanonName'):
+        # skip synonyms
+        return
+    for gene in GENES:
+        colname = f'{gene} Mutations'
+        muts = row.get(colname)
+        if not muts:
+            continue
+        mutlist = re.split(r'\s*\+\s*', muts)
+        mutlookup = load_mutations(*mutlist, default_gene=gene)
+        for (_, pos), aas in sorted(mutlookup.items()):
+            for aa in sorted(aas):
+                aa = (aa
+                      .replace('-', 'del')
+                      .replace('_', 'ins')
+                      .replace('*', 'stop'))
+                yield {
+                    'isolate_name': row['IsolateName'],
+                    'gene': gene,
+                    'position': pos,
+                    'amino_acid': aa
+                }
+
+
+def worksheet_to_mutations(
+    isolates: Iterable[CSVReaderRow]
+) -> Iterator[CSVWriterRow]:
+    for row in isolates:
+        yield from row_to_mutations(row)
 
 
 @cli.command()
@@ -20,33 +59,13 @@ def generate_mutations(input_worksheet: str, output_csv: str) -> None:
     os.makedirs(os.path.dirname(output_csv), exist_ok=True)
     click.echo(output_csv)
 
-    isolates = load_csv(input_worksheet)
-    records = []
-    for row in isolates:
-        if row.get('CanonName'):
-            # skip synonyms
-            continue
-        for gene in GENES:
-            colname = f'{gene} Mutations'
-            muts = row.get(colname)
-            if not muts:
-                continue
-            mutlist = re.split(r'\s*\+\s*', muts)
-            mutlookup = load_mutations(*mutlist, default_gene=gene)
-            for (_, pos), aas in sorted(mutlookup.items()):
-                for aa in sorted(aas):
-                    aa = (aa
-                          .replace('-', 'del')
-                          .replace('_', 'ins')
-                          .replace('*', 'stop'))
-                    records.append({
-                        'isolate_name': row['IsolateName'],
-                        'gene': gene,
-                        'position': pos,
-                        'amino_acid': aa
-                    })
     dump_csv(
         output_csv,
-        records,
-        ['isolate_name', 'gene', 'position', 'amino_acid']
+        worksheet_to_mutations(iter_csv(
+            input_worksheet,
+            columns=MUTATIONS_COLUMNS,
+            optional_columns=MUTATIONS_OPTIONAL_COLUMNS
+        )),
+        MUTATIONS_HEADERS,
+        only_if_changed=True
     )
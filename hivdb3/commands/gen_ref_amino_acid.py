@@ -2,13 +2,43 @@ import click
 from typing import Dict
 
 from ..cli import cli
-from ..utils.csvv import load_csv, dump_csv
-from ..utils.mutations import GenePos
+from ..utils.csvv import iter_csv, dump_csv
+from ..utils.cache import default_cache
+from ..utils.reference import ReferenceSequences
 
+CONSENSUS_COLUMNS = ['Gene', 'AASeq']
 
-def load_consensus(filename: str) -> Dict[GenePos, str]:
-    lookup: Dict[GenePos, str] = {}
-    for idx, row in enumerate(load_csv(filename)):
+
+def load_consensus(filename: str) -> ReferenceSequences:
+    """
+    Load consensus sequences, memory-mapping a cached copy when the CSV
+    is unchanged since the last invocation
+    """
+    return default_cache.memoized(
+        'consensus',
+        [filename],
+        lambda: map_consensus(filename),
+        modules=[__name__, ReferenceSequences.__module__, iter_csv.__module__]
+    )
+
+
+def map_consensus(filename: str) -> ReferenceSequences:
+    fp = default_cache.cached_file(
+        'consensus',
+        '.refseq',
+        [filename],
+        lambda fp: parse_consensus(filename).dump(fp),
+        modules=[__name__, ReferenceSequences.__module__, iter_csv.__module__]
+    )
+    if fp is None:
+        return parse_consensus(filename)
+    with fp:
+        return ReferenceSequences.load(fp)
+
+
+def parse_consensus(filename: str) -> ReferenceSequences:
+    seqs: Dict[str, bytes] = {}
+    for idx, row in enumerate(iter_csv(filename, columns=CONSENSUS_COLUMNS)):
         if row['Gene'] is None:
             click.echo(
                 "'Gene' cannot be empty (row: {})".format(idx + 2),
@@ -20,25 +50,31 @@ def load_consensus(filename: str) -> Dict[GenePos, str]:
                 err=True)
             raise click.Abort()
         gene = row['Gene']
-        for pos0, aa in enumerate(row['AASeq']):
-            lookup[(gene, pos0 + 1)] = aa
-    return lookup
+        seq = row['AASeq'].encode('ASCII')
+        # a repeated gene overrides the leading positions of earlier rows
+        seqs[gene] = seq + seqs.get(gene, b'')[len(seq):]
+    return ReferenceSequences(seqs)
 
 
-@cli.command()
-@click.argument(
-    'consensus_csv', type=click.Path(exists=True, dir_okay=False))
-@click.argument(
-    'output_csv', type=click.Path(dir_okay=False))
-def generate_ref_amino_acid(consensus_csv: str, output_csv: str) -> None:
+def dump_ref_amino_acid(consensus_csv: str, output_csv: str) -> None:
     click.echo(output_csv)
     lookup = load_consensus(consensus_csv)
     dump_csv(
         output_csv,
-        [{
+        ({
             'gene': gene,
             'position': pos,
             'amino_acid': aa
-        } for (gene, pos), aa in lookup.items()],
-        ['gene', 'position', 'amino_acid']
+        } for (gene, pos), aa in lookup.items()),
+        ['gene', 'position', 'amino_acid'],
+        only_if_changed=True
     )
+
+
+@cli.command()
+@click.argument(
+    'consensus_csv', type=click.Path(exists=True, dir_okay=False))
+@click.argument(
+    'output_csv', type=click.Path(dir_okay=False))
+def generate_ref_amino_acid(consensus_csv: str, output_csv: str) -> None:
+    dump_ref_amino_acid(consensus_csv, output_csv)
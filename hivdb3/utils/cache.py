@@ -0,0 +1,295 @@
+import os
+import sys
+import fcntl
+import pickle
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar,
+    Union, IO, cast
+)
+
+T = TypeVar('T')
+
+CACHE_DIR: str = os.environ.get('HIVDB3_CACHE_DIR', 'build/.cache')
+CACHE_MAX_BYTES: int = int(
+    os.environ.get('HIVDB3_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+)
+CACHE_DISABLED: bool = os.environ.get('HIVDB3_NO_CACHE', '') not in ('', '0')
+CACHE_SUFFIX = '.pickle'
+LOCK_FILE = '.lock'
+BUFFER_SIZE = 1024 * 1024
+
+
+def file_digest(*paths: Union[str, Path]) -> str:
+    """
+    SHA-256 hex digest over the contents of one or more files
+    """
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            while True:
+                chunk = fp.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def source_digest(*module_names: str) -> str:
+    """
+    Digest over the source files of already imported modules
+
+    Cache entries mix this in, so editing the code that produced an
+    entry invalidates it.
+    """
+    paths: List[str] = []
+    for name in module_names:
+        filename: Optional[str] = getattr(sys.modules[name], '__file__', None)
+        if filename:
+            paths.append(filename)
+    return file_digest(*paths)
+
+
+class DiskCache:
+    """
+    Content-addressed pickle cache shared by concurrent processes
+
+    Entries are written to a temporary file and atomically renamed
+    into place, so readers never observe a partial entry. Eviction
+    removes least-recently-used entries until the directory is under
+    `max_bytes`, holding an exclusive lock so that concurrent `make -j`
+    workers do not evict at the same time.
+
+    When `memory` is set, within a `keep_in_memory()` block or for the
+    lifetime of a `build` worker process, loaded values are also kept
+    in process, so that long-running callers parse each input once.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path] = CACHE_DIR,
+        max_bytes: int = CACHE_MAX_BYTES
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.memory: Optional[Dict[Tuple[str, str], Any]] = None
+        self.memory_lock = threading.Lock()
+
+    @contextmanager
+    def keep_in_memory(self) -> Iterator[None]:
+        prev_memory = self.memory
+        self.memory = {}
+        try:
+            yield
+        finally:
+            self.memory = prev_memory
+
+    def entry_path(
+        self,
+        namespace: str,
+        key: str,
+        suffix: str = CACHE_SUFFIX
+    ) -> Path:
+        return self.cache_dir / f'{namespace}-{key}{suffix}'
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / LOCK_FILE, 'a') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+        path = self.entry_path(namespace, key)
+        try:
+            with open(path, 'rb') as fp:
+                value = pickle.load(fp)
+        except (
+            FileNotFoundError, EOFError, pickle.UnpicklingError,
+            # stale entries of renamed or removed classes
+            AttributeError, ImportError
+        ):
+            return False, None
+        try:
+            # refresh atime/mtime for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return True, value
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        self.write(
+            self.entry_path(namespace, key),
+            lambda fp: pickle.dump(value, fp, pickle.HIGHEST_PROTOCOL)
+        )
+
+    def create(
+        self,
+        path: Path,
+        writer: Callable[[IO[bytes]], None]
+    ) -> IO[bytes]:
+        """
+        Atomically create a cache entry with `writer`, return it opened
+        for reading
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f'.{path.name}.', dir=self.cache_dir)
+        fp = os.fdopen(fd, 'w+b')
+        try:
+            writer(fp)
+            fp.flush()
+            os.replace(tmp_path, path)
+        except BaseException:
+            fp.close()
+            os.unlink(tmp_path)
+            raise
+        fp.seek(0)
+        return fp
+
+    def write(self, path: Path, writer: Callable[[IO[bytes]], None]) -> None:
+        """
+        Atomically create a cache entry with `writer`, then evict
+        """
+        self.create(path, writer).close()
+        self.evict()
+
+    def evict(self) -> None:
+        with self.lock():
+            entries: List[Tuple[float, int, Path]] = []
+            for path in self.cache_dir.iterdir():
+                if path.name.startswith('.'):
+                    # lock and in-progress temporary files
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def key(
+        self,
+        paths: Iterable[Union[str, Path]],
+        modules: Iterable[str] = (),
+        salt: str = ''
+    ) -> str:
+        return hashlib.sha256('\0'.join([
+            file_digest(*paths),
+            source_digest(__name__, *modules),
+            salt
+        ]).encode('UTF-8')).hexdigest()
+
+    def cached_file(
+        self,
+        namespace: str,
+        suffix: str,
+        paths: Iterable[Union[str, Path]],
+        writer: Callable[[IO[bytes]], None],
+        modules: Iterable[str] = (),
+        salt: str = ''
+    ) -> Optional[IO[bytes]]:
+        """
+        Open a raw cache entry, created by `writer` if missing
+
+        Suitable for entries that are memory-mapped instead of
+        unpickled. The entry is opened under the eviction lock, so a
+        concurrent eviction can not remove it before it is read. Returns
+        None when the cache is disabled.
+        """
+        if CACHE_DISABLED:
+            return None
+        path = self.entry_path(
+            namespace, self.key(paths, modules, salt), suffix)
+        fp: IO[bytes]
+        with self.lock():
+            try:
+                fp = open(path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                # refresh atime/mtime for LRU eviction
+                os.utime(fp.fileno())
+                return fp
+        fp = self.create(path, writer)
+        self.evict()
+        return fp
+
+    def memoized(
+        self,
+        namespace: str,
+        paths: Iterable[Union[str, Path]],
+        loader: Callable[[], T],
+        modules: Iterable[str] = (),
+        salt: str = ''
+    ) -> T:
+        """
+        Return `loader()`, kept in process within `keep_in_memory()`
+
+        Values are shared between callers and must not be modified.
+        """
+        memory = self.memory
+        if memory is None:
+            return loader()
+        key = (namespace, self.key(paths, modules, salt))
+        with self.memory_lock:
+            if key in memory:
+                return cast(T, memory[key])
+        value = loader()
+        with self.memory_lock:
+            return cast(T, memory.setdefault(key, value))
+
+    def cached(
+        self,
+        namespace: str,
+        paths: Iterable[Union[str, Path]],
+        loader: Callable[[], T],
+        modules: Iterable[str] = (),
+        salt: str = '',
+        memo: bool = False
+    ) -> T:
+        """
+        Return `loader()`, cached by the content of `paths`
+
+        `modules` are names of the modules whose source should also
+        invalidate the entry when changed; `salt` covers any other
+        argument that affects the result. With `memo`, the value is
+        also kept in process as by `memoized`.
+        """
+        memory = self.memory if memo else None
+        if CACHE_DISABLED:
+            if memory is None:
+                return loader()
+            return self.memoized(namespace, paths, loader, modules, salt)
+        key = self.key(paths, modules, salt)
+        if memory is not None:
+            with self.memory_lock:
+                if (namespace, key) in memory:
+                    return cast(T, memory[(namespace, key)])
+        hit, value = self.get(namespace, key)
+        if not hit:
+            value = loader()
+            self.put(namespace, key, value)
+        if memory is not None:
+            with self.memory_lock:
+                value = memory.setdefault((namespace, key), value)
+        return cast(T, value)
+
+
+default_cache = DiskCache()
@@ -1,4 +1,7 @@
-from typing import Dict, List, Set
+import threading
+from collections import OrderedDict
+from itertools import product
+from typing import Dict, List, Set, Union, Optional, NamedTuple
 
 
 AMINO_ACID_LIST: List[int] = [
@@ -129,15 +132,90 @@ AMBIGUOUS_NAS: Dict[int, bytes] = {
 }
 
 
+# 4-bit IUPAC masks; A, C, G and T are the four bits
+NA_BITS: Dict[int, int] = {
+    ord(b'A'): 0b0001,
+    ord(b'C'): 0b0010,
+    ord(b'G'): 0b0100,
+    ord(b'T'): 0b1000
+}
+
+NA_MASKS: Dict[int, int] = {
+    **NA_BITS,
+    **{
+        na: sum(NA_BITS[unambi_na] for unambi_na in unambi_nas)
+        for na, unambi_nas in AMBIGUOUS_NAS.items()
+    },
+    ord(b'-'): 0b1111  # treated as N, the same as translate_codon
+}
+
+# `bytes.translate` table: nucleotide -> mask; 0 for invalid characters
+NA_MASK_TABLE: bytes = bytes(NA_MASKS.get(na, 0) for na in range(256))
+
+
+def translate_mask_codon(mask0: int, mask1: int, mask2: int) -> bytes:
+    """
+    Three nucleotide masks -> sorted amino acid mixture
+    """
+    aas: Set[int] = set()
+    for na0 in NA_BITS:
+        if not mask0 & NA_BITS[na0]:
+            continue
+        for na1 in NA_BITS:
+            if not mask1 & NA_BITS[na1]:
+                continue
+            for na2 in NA_BITS:
+                if mask2 & NA_BITS[na2]:
+                    aas.add(CODON_TABLE[bytes([na0, na1, na2])][0])
+    return bytes(sorted(aas))
+
+
+# Indexed by `mask0 << 8 | mask1 << 4 | mask2`; every ambiguous codon
+# is resolved ahead of time, codons with an invalid nucleotide map to b''
+CODON_MASK_TABLE: List[bytes] = [
+    translate_mask_codon(idx >> 8, idx >> 4 & 0xf, idx & 0xf)
+    for idx in range(16 ** 3)
+]
+
+
+def translate_sequence(
+    nas: Union[bytes, bytearray, memoryview]
+) -> List[bytes]:
+    """
+    Translate a nucleotide sequence into a list of amino acid mixtures
+
+    Every nucleotide is encoded as a 4-bit IUPAC mask and all codons
+    are resolved through CODON_MASK_TABLE. A memoryview is copied
+    once, since `translate` is only available on bytes and bytearray.
+    A trailing incomplete codon is ignored.
+    """
+    codes: Union[bytes, bytearray]
+    if isinstance(nas, memoryview):
+        nas = nas.cast('B')
+        codes = nas.tobytes().translate(NA_MASK_TABLE)
+    else:
+        codes = nas.translate(NA_MASK_TABLE)
+    invalid = codes.find(0)
+    if invalid > -1:
+        raise ValueError(
+            'Invalid nucleotide {!r} at position {}'
+            .format(chr(nas[invalid]), invalid + 1)
+        )
+    view = memoryview(codes)
+    return [
+        CODON_MASK_TABLE[mask0 << 8 | mask1 << 4 | mask2]
+        for mask0, mask1, mask2 in zip(view[0::3], view[1::3], view[2::3])
+    ]
+
+
+IUPAC_NAS: bytes = bytes(sorted(NA_MASKS.keys() - {ord(b'-')}))
+
+
 def expand_ambiguous_na(na: int) -> bytes:
     return AMBIGUOUS_NAS.get(na, bytes([na]))
 
 
-def translate_codon(nas: bytes) -> bytes:
-    aas_text: bytes
-    nas = nas.replace(b'-', b'N')[:3]
-    if nas in CODON_TABLE:
-        return CODON_TABLE[nas]
+def translate_ambiguous_codon(nas: bytes) -> bytes:
     aas: Set[int] = set()
     for na0 in AMBIGUOUS_NAS.get(nas[0], nas[0:1]):
         for na1 in AMBIGUOUS_NAS.get(nas[1], nas[1:2]):
@@ -145,5 +223,75 @@ def translate_codon(nas: bytes) -> bytes:
                 aas |= set(
                     CODON_TABLE[bytes([na0, na1, na2])]
                 )
-    CODON_TABLE[nas] = aas_text = bytes((sorted(aas)))
-    return aas_text
+    return bytes(sorted(aas))
+
+
+class CodonCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    capacity: Optional[int]
+    size: int
+
+
+class CodonMixtureCache:
+    """
+    Thread-safe cache of ambiguous codon -> amino acid mixture
+
+    With `precompute`, all 15^3 IUPAC triplets are resolved upfront
+    from CODON_MASK_TABLE. Otherwise entries are filled on demand and,
+    if `capacity` is given, the least recently used one is evicted once
+    the cache is full. `hits` and `misses` count how often the slow
+    path (`translate_ambiguous_codon`) was avoided or taken.
+    """
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        precompute: bool = False
+    ) -> None:
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._mixtures: 'OrderedDict[bytes, bytes]' = OrderedDict()
+        if precompute:
+            for codon in product(IUPAC_NAS, repeat=3):
+                mask0, mask1, mask2 = (NA_MASKS[na] for na in codon)
+                self._mixtures[bytes(codon)] = \
+                    CODON_MASK_TABLE[mask0 << 8 | mask1 << 4 | mask2]
+
+    def get(self, nas: bytes) -> bytes:
+        with self._lock:
+            mixture = self._mixtures.get(nas)
+            if mixture is not None:
+                self.hits += 1
+                if self.capacity is not None:
+                    self._mixtures.move_to_end(nas)
+                return mixture
+            self.misses += 1
+        mixture = translate_ambiguous_codon(nas)
+        with self._lock:
+            self._mixtures[nas] = mixture
+            if self.capacity is not None and \
+                    len(self._mixtures) > self.capacity:
+                self._mixtures.popitem(last=False)
+        return mixture
+
+    def cache_info(self) -> CodonCacheInfo:
+        with self._lock:
+            return CodonCacheInfo(
+                self.hits,
+                self.misses,
+                self.capacity,
+                len(self._mixtures)
+            )
+
+
+AMBIGUOUS_CODON_CACHE = CodonMixtureCache(precompute=True)
+
+
+def translate_codon(nas: bytes) -> bytes:
+    nas = nas.replace(b'-', b'N')[:3]
+    if nas in CODON_TABLE:
+        return CODON_TABLE[nas]
+    return AMBIGUOUS_CODON_CACHE.get(nas)
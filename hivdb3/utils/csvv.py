@@ -1,40 +1,311 @@
+import io
+import os
 import csv
+import pickle
+import hashlib
+import tempfile
+import click
 from pathlib import Path
-from itertools import chain
-from more_itertools import unique_everseen
-from typing import List, Dict, Optional, Union, Any, Iterable
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import Executor, Future
+from types import TracebackType
+from contextlib import ExitStack
+from typing import (
+    List, Deque, Dict, Optional, Union, Any, Iterable, Iterator, Mapping,
+    Sequence, Tuple, Type, IO, TextIO
+)
+
+from .cache import default_cache
 
 CSVReaderRow = Dict[str, Optional[str]]
 CSVWriterRow = Dict[str, Any]
 
+BUFFER_SIZE = 1024 * 1024
+
+
+def current_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# read once; os.umask() is process-wide and not safe to toggle in threads
+UMASK = current_umask()
+
+
+def iter_csv(
+    file_path: Union[str, Path],
+    null_str: str = r'NULL',
+    columns: Optional[Sequence[str]] = None,
+    optional_columns: Sequence[str] = ()
+) -> Iterator[CSVReaderRow]:
+    """
+    Lazily yield rows of a CSV file
+
+    Cells equal to `null_str` are normalized to None. Rows are produced
+    one at a time, so the file is never fully resident in memory.
+
+    When `columns` or `optional_columns` is given, rows only contain
+    those columns; other cells are never turned into dict entries.
+    A missing column in `columns` is an error, while a missing column
+    in `optional_columns` is read as None.
+    """
+    if columns is None and not optional_columns:
+        with open(file_path, encoding='utf-8-sig') as fd:
+            row: CSVReaderRow
+            for row in csv.DictReader(fd):
+                for key, val in row.items():
+                    if val == null_str:
+                        row[key] = None
+                yield row
+        return
+
+    with open(file_path, encoding='utf-8-sig') as fd:
+        reader = csv.reader(fd)
+        header: List[str] = next(reader, [])
+        # like csv.DictReader, the last of duplicated columns wins
+        indices: Dict[str, int] = {
+            name: idx for idx, name in enumerate(header)}
+        missing = [col for col in columns or () if col not in indices]
+        if missing:
+            raise click.ClickException(
+                '{} is missing column(s): {}'.format(
+                    file_path, ', '.join(repr(col) for col in missing)))
+        projection: List[Tuple[str, int]] = [
+            (col, indices.get(col, -1))
+            for col in chain(columns or (), optional_columns)
+        ]
+        for cells in reader:
+            if not cells:
+                # skipped by csv.DictReader as well
+                continue
+            size = len(cells)
+            yield {
+                col: None if idx < 0 or idx >= size or cells[idx] == null_str
+                else cells[idx]
+                for col, idx in projection
+            }
+
 
 def load_csv(
     file_path: Union[str, Path],
-    null_str: str = r'NULL'
+    null_str: str = r'NULL',
+    cached: bool = False,
+    columns: Optional[Sequence[str]] = None,
+    optional_columns: Sequence[str] = ()
 ) -> List[CSVReaderRow]:
-    with open(file_path, encoding='utf-8-sig') as fd:
-        row: CSVReaderRow
-        rows: List[CSVReaderRow] = []
-        for _row in csv.DictReader(fd):
-            row = {**_row}
-            for key, val in row.items():
-                if val == null_str:
-                    row[key] = None
-            rows.append(row)
-        return rows
+    """
+    Load all rows of a CSV file, see `iter_csv` for the column
+    projection
+
+    With `cached`, the parsed rows are kept in the on-disk cache keyed
+    by the file content, so repeated invocations skip the CSV parse.
+    """
+    if cached:
+        return default_cache.cached(
+            'csv',
+            [file_path],
+            lambda: load_csv(
+                file_path, null_str,
+                columns=columns, optional_columns=optional_columns),
+            modules=[__name__],
+            salt=repr((null_str, columns, tuple(optional_columns)))
+        )
+    return list(iter_csv(file_path, null_str, columns, optional_columns))
+
+
+def list_csvs(csv_dir: Union[str, Path]) -> List[Path]:
+    return [
+        child for child in sorted(Path(csv_dir).iterdir())
+        if child.suffix.lower() == '.csv'
+    ]
+
+
+def iter_multiple_csvs(
+    csv_dir: Union[str, Path],
+    null_str: str = r'NULL',
+    columns: Optional[Sequence[str]] = None,
+    optional_columns: Sequence[str] = (),
+    workers: int = 0,
+    use_processes: bool = False,
+    max_in_flight: Optional[int] = None
+) -> Iterator[CSVReaderRow]:
+    """
+    Lazily yield rows of all CSV files in a directory, in file order
+
+    By default the files are streamed one after another. With
+    `workers` > 0, files are parsed on a thread (or with
+    `use_processes`, a process) pool, and rows are still yielded in
+    sorted file order. At most `max_in_flight` parsed files (default:
+    `workers`, at least 1) are held in memory at once; the next file is
+    only submitted once the oldest one has been consumed.
+    """
+    paths = list_csvs(csv_dir)
+    if workers <= 0:
+        for path in paths:
+            yield from iter_csv(path, null_str, columns, optional_columns)
+        return
+
+    # imported here to keep the start-up of the commands cheap
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    executor: Executor
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight: Deque['Future[List[CSVReaderRow]]'] = deque()
+    limit = max(1, max_in_flight or workers)
+    remaining = iter(paths)
+    with executor:
+        try:
+            for path in islice(remaining, limit):
+                in_flight.append(executor.submit(
+                    load_csv, path, null_str,
+                    columns=columns, optional_columns=optional_columns))
+            while in_flight:
+                rows = in_flight.popleft().result()
+                for path in islice(remaining, 1):
+                    in_flight.append(executor.submit(
+                        load_csv, path, null_str,
+                        columns=columns, optional_columns=optional_columns))
+                yield from rows
+                del rows
+        finally:
+            for future in in_flight:
+                future.cancel()
 
 
 def load_multiple_csvs(
     csv_dir: Union[str, Path],
-    null_str: str = r'NULL'
+    null_str: str = r'NULL',
+    columns: Optional[Sequence[str]] = None,
+    optional_columns: Sequence[str] = (),
+    workers: int = 0
 ) -> List[CSVReaderRow]:
-    child: Path
-    rows: List[CSVReaderRow] = []
-    for child in sorted(Path(csv_dir).iterdir()):
-        if child.suffix.lower() != '.csv':
-            continue
-        rows.extend(load_csv(child, null_str))
-    return rows
+    return list(iter_multiple_csvs(
+        csv_dir, null_str, columns, optional_columns, workers))
+
+
+def spill_records(
+    records: Iterator[CSVWriterRow],
+    fp: IO[bytes]
+) -> List[str]:
+    """
+    Spill records to a temporary file and return their headers
+
+    Used by `dump_csv` when headers must be inferred; the records are
+    pickled one by one so only the header list is kept in memory.
+    """
+    row: CSVWriterRow
+    headers: Dict[str, None] = {}
+    for row in records:
+        pickle.dump(row, fp, pickle.HIGHEST_PROTOCOL)
+        headers.update(dict.fromkeys(row))
+    fp.seek(0)
+    return list(headers)
+
+
+def unspill_records(fp: IO[bytes]) -> Iterator[CSVWriterRow]:
+    while True:
+        try:
+            yield pickle.load(fp)
+        except EOFError:
+            break
+
+
+class HashingFileIO(io.FileIO):
+    """
+    Binary file computing the SHA-256 of everything written to it
+    """
+
+    def __init__(self, fd: int) -> None:
+        super().__init__(fd, 'wb')
+        self.sha = hashlib.sha256()
+
+    def write(self, data: Any) -> int:
+        size = super().write(data)
+        self.sha.update(memoryview(data)[:size])
+        return size
+
+
+def content_sha256(file_path: Union[str, Path]) -> bytes:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        while True:
+            chunk = fp.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.digest()
+
+
+class ChangedFileWriter:
+    """
+    Write a text file atomically, and only if its content changed
+
+    The content is streamed to a temporary file in the same directory
+    while being hashed. On exit it is compared with the existing file:
+    if identical, the temporary file is discarded and the existing one
+    (and its mtime) is left untouched; otherwise it is renamed into
+    place, so readers never see a partially written file. `changed`
+    tells which of the two happened.
+    """
+
+    def __init__(self, file_path: Union[str, Path], encoding: str) -> None:
+        self.file_path = Path(file_path)
+        self.encoding = encoding
+        self.changed = False
+        self.tmp_path: Optional[str] = None
+        self.raw: Optional[HashingFileIO] = None
+        self.fd: Optional[TextIO] = None
+
+    def __enter__(self) -> TextIO:
+        fd, self.tmp_path = tempfile.mkstemp(
+            prefix=f'.{self.file_path.name}.',
+            dir=self.file_path.parent)
+        self.raw = HashingFileIO(fd)
+        self.fd = io.TextIOWrapper(
+            io.BufferedWriter(self.raw), encoding=self.encoding)
+        return self.fd
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType]
+    ) -> None:
+        if self.fd is None or self.raw is None or self.tmp_path is None:
+            raise RuntimeError('ChangedFileWriter is not entered')
+        try:
+            self.fd.close()
+            if exc_type is None and self.is_changed(self.raw.sha.digest()):
+                # mkstemp creates the file private to the user
+                os.chmod(self.tmp_path, 0o666 & ~UMASK)
+                os.replace(self.tmp_path, self.file_path)
+                self.changed = True
+        finally:
+            if not self.changed:
+                os.unlink(self.tmp_path)
+
+    def is_changed(self, digest: bytes) -> bool:
+        try:
+            if os.path.getsize(self.file_path) != \
+                    os.path.getsize(self.tmp_path or ''):
+                return True
+            return content_sha256(self.file_path) != digest
+        except FileNotFoundError:
+            return True
+
+
+def open_output(
+    file_path: Union[str, Path],
+    encoding: str,
+    only_if_changed: bool
+) -> Union[TextIO, ChangedFileWriter]:
+    if only_if_changed:
+        return ChangedFileWriter(file_path, encoding)
+    return open(file_path, 'w', encoding=encoding)
 
 
 def dump_csv(
@@ -42,34 +313,112 @@ def dump_csv(
     records: Iterable[CSVWriterRow],
     headers: List[str] = [],
     BOM: bool = False,
-    null_str: str = r'NULL'
-) -> None:
+    null_str: str = r'NULL',
+    only_if_changed: bool = False
+) -> bool:
+    """
+    Write records to a CSV file, return if the file was written
+
+    Records are consumed in a single pass. When `headers` is given,
+    each row is written as soon as it is produced; otherwise the
+    records are spilled to a temporary file while the headers are
+    collected. Nothing is written if `records` is empty.
+
+    With `only_if_changed`, the file is replaced atomically and only
+    when its content differs (see `ChangedFileWriter`).
+    """
     encoding: str
     writer: csv.DictWriter
+    row: CSVWriterRow
+    spill: Optional[IO[bytes]] = None
+    _records: Iterator[CSVWriterRow] = iter(records)
+    try:
+        first: CSVWriterRow = next(_records)
+    except StopIteration:
+        return False
+    _records = chain([first], _records)
+
+    try:
+        if not headers:
+            spill = tempfile.TemporaryFile()
+            headers = spill_records(_records, spill)
+            _records = unspill_records(spill)
+
+        if BOM:
+            encoding = 'utf-8-sig'
+        else:
+            encoding = 'utf-8'
+
+        output = open_output(file_path, encoding, only_if_changed)
+        with output as fd:
+            writer = csv.DictWriter(
+                fd,
+                fieldnames=headers,
+                restval=null_str,
+                extrasaction='ignore')
+            writer.writeheader()
+            for row in _records:
+                writer.writerow(fill_nulls(row, null_str))
+    finally:
+        if spill is not None:
+            spill.close()
+    if isinstance(output, ChangedFileWriter):
+        return output.changed
+    return True
+
+
+def fill_nulls(row: CSVWriterRow, null_str: str) -> CSVWriterRow:
     key: str
+    for key, val in row.items():
+        if val is None:
+            row[key] = null_str
+    return row
+
+
+def dump_csv_partitions(
+    records: Iterable[Tuple[str, CSVWriterRow]],
+    outputs: Mapping[str, Tuple[Union[str, Path], List[str]]],
+    BOM: bool = False,
+    null_str: str = r'NULL',
+    only_if_changed: bool = False
+) -> List[str]:
+    """
+    Write records tagged by output name to several CSV files at once,
+    return the tags of the files written
+
+    `outputs` maps each tag to a (file path, headers) pair. Like
+    `dump_csv`, records are consumed in a single pass. Unlike it, an
+    output without records is still written with only its headers, so
+    that stale rows of an earlier run do not remain.
+    """
+    tag: str
     row: CSVWriterRow
-    _records: List[CSVWriterRow] = list(records)
-    if not _records:
-        return
-    if not headers:
-        headers = list(unique_everseen(
-            chain(*[r.keys() for r in _records])
-        ))
+    encoding: str = 'utf-8-sig' if BOM else 'utf-8'
+    writers: Dict[str, csv.DictWriter] = {}
+    opened: Dict[str, Union[TextIO, ChangedFileWriter]] = {}
+    with ExitStack() as stack:
 
-    if BOM:
-        encoding = 'utf-8-sig'
-    else:
-        encoding = 'utf-8'
-
-    with open(file_path, 'w', encoding=encoding) as fd:
-        writer = csv.DictWriter(
-            fd,
-            fieldnames=headers,
-            restval=null_str,
-            extrasaction='ignore')
-        writer.writeheader()
-        for row in _records:
-            for key, val in row.items():
-                if val is None:
-                    row[key] = null_str
-            writer.writerow(row)
+        def open_writer(tag: str) -> csv.DictWriter:
+            file_path, headers = outputs[tag]
+            opened[tag] = open_output(file_path, encoding, only_if_changed)
+            fd = stack.enter_context(opened[tag])
+            writer = writers[tag] = csv.DictWriter(
+                fd,
+                fieldnames=headers,
+                restval=null_str,
+                extrasaction='ignore')
+            writer.writeheader()
+            return writer
+
+        for tag, row in records:
+            writer = writers.get(tag)
+            if writer is None:
+                writer = open_writer(tag)
+            writer.writerow(fill_nulls(row, null_str))
+        for tag in outputs:
+            if tag not in writers:
+                open_writer(tag)
+    return [
+        tag for tag, output in opened.items()
+        if not isinstance(output, ChangedFileWriter) or output.changed
+    ]
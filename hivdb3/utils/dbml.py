@@ -0,0 +1,186 @@
+import re
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class DBMLColumn(NamedTuple):
+    name: str
+    type: str
+    pk: bool = False
+    unique: bool = False
+    not_null: bool = False
+
+
+class DBMLIndex(NamedTuple):
+    columns: Tuple[str, ...]
+    pk: bool = False
+    unique: bool = False
+    name: Optional[str] = None
+
+
+class DBMLTable(NamedTuple):
+    name: str
+    columns: List[DBMLColumn]
+    indexes: List[DBMLIndex]
+
+    @property
+    def primary_key(self) -> Tuple[str, ...]:
+        for index in self.indexes:
+            if index.pk:
+                return index.columns
+        return tuple(col.name for col in self.columns if col.pk)
+
+
+class DBMLSchema(NamedTuple):
+    enums: Dict[str, Tuple[str, ...]]
+    tables: List[DBMLTable]
+
+
+TABLE_PATTERN = re.compile(r'^Table\s+("[^"]+"|\w+)(?:\s+as\s+\w+)?\s*{$')
+ENUM_PATTERN = re.compile(r'^Enum\s+("[^"]+"|\w+)\s*{$')
+COLUMN_PATTERN = re.compile(
+    r'^("[^"]+"|\w+)\s+(\w+(?:\s*\([\d\s,]*\))?)\s*(\[.*\])?$')
+INDEX_PATTERN = re.compile(r'^(\([^)]*\)|"[^"]+"|\w+)\s*(\[.*\])?$')
+
+
+def unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'`':
+        return value[1:-1]
+    return value
+
+
+def split_outside_quotes(text: str, separator: str) -> List[str]:
+    parts: List[str] = []
+    quote: Optional[str] = None
+    depth = 0
+    start = 0
+    for idx, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'`':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:idx])
+            start = idx + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_settings(settings: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    Column or index settings, e.g. `[pk, note: '...']`, lowercased
+    """
+    if not settings:
+        return {}
+    result: Dict[str, Optional[str]] = {}
+    for item in split_outside_quotes(settings.strip()[1:-1], ','):
+        key, colon, value = item.partition(':')
+        key = ' '.join(key.lower().split())
+        if key:
+            result[key] = unquote(value) if colon else None
+    return result
+
+
+def logical_lines(text: str) -> Iterator[str]:
+    """
+    Lines of a DBML file with comments removed and multi-line settings
+    (`[ ... ]`) and notes joined into a single line
+    """
+    buffer = ''
+    for line in text.splitlines():
+        line = re.sub(r'^\s*//.*$', '', line).strip()
+        if not line:
+            continue
+        buffer = '{} {}'.format(buffer, line) if buffer else line
+        quote: Optional[str] = None
+        depth = 0
+        for char in buffer:
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in '"\'`':
+                quote = char
+            elif char == '[':
+                depth += 1
+            elif char == ']':
+                depth -= 1
+        if depth == 0 and quote is None:
+            yield buffer
+            buffer = ''
+    if buffer:
+        raise ValueError('Unterminated DBML statement: {}'.format(buffer))
+
+
+def parse_dbml(text: str) -> DBMLSchema:
+    """
+    Parse the tables, columns, indexes and enums of a DBML document
+
+    Only the subset of DBML which `schema.dbml` uses is supported;
+    references, notes and project settings are skipped.
+    """
+    enums: Dict[str, Tuple[str, ...]] = {}
+    tables: List[DBMLTable] = []
+    enum: Optional[List[str]] = None
+    enum_name = ''
+    table: Optional[DBMLTable] = None
+    in_indexes = False
+    for line in logical_lines(text):
+        if table is not None:
+            if in_indexes:
+                if line == '}':
+                    in_indexes = False
+                    continue
+                match = INDEX_PATTERN.match(line)
+                if not match:
+                    raise ValueError('Invalid index: {}'.format(line))
+                columns, settings = match.groups()
+                names = tuple(
+                    unquote(col) for col in
+                    split_outside_quotes(columns.strip('()'), ','))
+                opts = parse_settings(settings)
+                table.indexes.append(DBMLIndex(
+                    names, pk='pk' in opts, unique='unique' in opts,
+                    name=opts.get('name')))
+            elif line == '}':
+                tables.append(table)
+                table = None
+            elif re.match(r'^indexes\s*{$', line):
+                in_indexes = True
+            elif re.match(r'^note\s*:', line, re.I):
+                continue
+            else:
+                match = COLUMN_PATTERN.match(line)
+                if not match:
+                    raise ValueError('Invalid column: {}'.format(line))
+                name, type_, settings = match.groups()
+                opts = parse_settings(settings)
+                table.columns.append(DBMLColumn(
+                    unquote(name), ''.join(type_.split()),
+                    pk='pk' in opts or 'primary key' in opts,
+                    unique='unique' in opts,
+                    not_null='not null' in opts))
+        elif enum is not None:
+            if line == '}':
+                enums[enum_name] = tuple(enum)
+                enum = None
+            else:
+                match = re.match(r'^("[^"]*"|\S+)', line)
+                if match:
+                    enum.append(unquote(match.group(1)))
+        elif match := TABLE_PATTERN.match(line):
+            table = DBMLTable(unquote(match.group(1)), [], [])
+        elif match := ENUM_PATTERN.match(line):
+            enum_name = unquote(match.group(1))
+            enum = []
+        elif line.startswith('Ref'):
+            continue
+        else:
+            raise ValueError('Unsupported DBML statement: {}'.format(line))
+    if table is not None or enum is not None or in_indexes:
+        raise ValueError('Unterminated DBML block')
+    return DBMLSchema(enums, tables)
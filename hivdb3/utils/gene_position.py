@@ -1,76 +1,112 @@
 import warnings
-from typing import Tuple
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Tuple, Dict, List, Sequence, Optional, NamedTuple
 
 
-def translate_gene_position(gene: str, pos: int) -> Tuple[str, int]:
+class Polyprotein(NamedTuple):
+    # inclusive upper bound of each gene but the last one
+    bounds: List[int]
+    genes: List[str]
+    # offset subtracted from the polyprotein position, per gene
+    offsets: List[int]
+
+
+POLYPROTEINS: Dict[str, Polyprotein] = {}
+
+ORF1A = Polyprotein(
+    bounds=[180, 818, 2763, 3263, 3569, 3859, 3942, 4140, 4253, 4392],
+    genes=['nsp1', 'nsp2', 'PLpro', 'nsp4', '_3CLpro', 'nsp6',
+           'nsp7', 'nsp8', 'nsp9', 'nsp10', 'RdRP'],
+    offsets=[0, 180, 818, 2763, 3263, 3569, 3859, 3942, 4140, 4253, 4392]
+)
+POLYPROTEINS['orf1a'] = POLYPROTEINS['orf1ab'] = ORF1A
+
+POLYPROTEINS['orf1b'] = Polyprotein(
+    bounds=[923, 1524, 2051, 2397],
+    genes=['RdRP', 'nsp13', 'nsp14', 'nsp15', 'nsp16'],
+    offsets=[-9, 923, 1524, 2051, 2397]
+)
+
+GENE_ALIASES: Dict[str, str] = {
+    'nsp3': 'PLpro',
+    'nsp5': '_3CLpro',
+    '3clpro': '_3CLpro',
+    '3cl': '_3CLpro',
+    'mpro': '_3CLpro',
+    'mainpro': '_3CLpro',
+    'nsp11': 'RdRP',
+    **dict.fromkeys(['s', 'spike', 'ns2', 'orf2', 'gp02'], 'S'),
+    **dict.fromkeys(['ns3', 'orf3', 'gp03'], 'ORF3'),
+    **dict.fromkeys(['e', 'ns4', 'orf4', 'gp04'], 'E'),
+    **dict.fromkeys(['m', 'ns5', 'orf5', 'gp05'], 'M'),
+    **dict.fromkeys(['ns6', 'orf6', 'gp06'], 'ORF6'),
+    **dict.fromkeys(['ns7a', 'orf7a', 'gp07'], 'ORF7a'),
+    **dict.fromkeys(['ns7b', 'orf7b', 'gp08'], 'ORF7b'),
+    **dict.fromkeys(['ns8', 'orf8', 'gp09'], 'ORF8'),
+    **dict.fromkeys(['n', 'ns9', 'orf9', 'gp10'], 'N'),
+    **dict.fromkeys(['ns10', 'orf10', 'gp11'], 'ORF10'),
+}
+
+
+@lru_cache(maxsize=None)
+def lookup_gene(gene: str) -> Tuple[Optional[Polyprotein], str]:
     lower_gene = gene.lower()
-    if lower_gene in ('orf1a', 'orf1ab'):
-        if pos <= 180:
-            return 'nsp1', pos
-        elif pos <= 818:
-            return 'nsp2', pos - 180
-        elif pos <= 2763:
-            return 'PLpro', pos - 818
-        elif pos <= 3263:
-            return 'nsp4', pos - 2763
-        elif pos <= 3569:
-            return '_3CLpro', pos - 3263
-        elif pos <= 3859:
-            return 'nsp6', pos - 3569
-        elif pos <= 3942:
-            return 'nsp7', pos - 3859
-        elif pos <= 4140:
-            return 'nsp8', pos - 3942
-        elif pos <= 4253:
-            return 'nsp9', pos - 4140
-        elif pos <= 4392:
-            return 'nsp10', pos - 4253
-        else:
-            return 'RdRP', pos - 4392
-    elif lower_gene == 'nsp3':
-        return 'PLpro', pos
-    elif lower_gene in ('nsp5', '3clpro', '3cl', 'mpro', 'mainpro'):
-        return '_3CLpro', pos
-    elif lower_gene == 'nsp11':
-        return 'RdRP', pos
-    elif lower_gene == 'nsp12':
+    if lower_gene in POLYPROTEINS:
+        return POLYPROTEINS[lower_gene], gene
+    elif lower_gene in GENE_ALIASES:
+        return None, GENE_ALIASES[lower_gene]
+    elif lower_gene.startswith('nsp'):
+        return None, lower_gene
+    return None, gene
+
+
+def resolve_gene(gene: str) -> Tuple[Optional[Polyprotein], str]:
+    """
+    Gene -> (polyprotein, gene) or (None, canonical gene)
+
+    The lookup is memoized per input gene; the nsp12 warning is not, so
+    it is issued on every call as before.
+    """
+    polyprotein, canonical_gene = lookup_gene(gene)
+    if canonical_gene == 'nsp12':
         warnings.warn(
             'Unchanged ambiguous gene nsp12: '
             'nsp12 can be either the whole RdRP '
             'or just partial RdRP in ORF1b.'
         )
-        return 'nsp12', pos
-    elif lower_gene.startswith('nsp'):
-        return lower_gene, pos
-    elif lower_gene == 'orf1b':
-        if pos <= 923:
-            return 'RdRP', pos + 9
-        elif pos <= 1524:
-            return 'nsp13', pos - 923
-        elif pos <= 2051:
-            return 'nsp14', pos - 1524
-        elif pos <= 2397:
-            return 'nsp15', pos - 2051
+    return polyprotein, canonical_gene
+
+
+def translate_gene_position(gene: str, pos: int) -> Tuple[str, int]:
+    polyprotein, canonical_gene = resolve_gene(gene)
+    if polyprotein is None:
+        return canonical_gene, pos
+    idx = bisect_left(polyprotein.bounds, pos)
+    return polyprotein.genes[idx], pos - polyprotein.offsets[idx]
+
+
+def translate_gene_positions(
+    genes: Sequence[str],
+    positions: Sequence[int]
+) -> Tuple[List[str], List[int]]:
+    """
+    Batch version of translate_gene_position
+
+    Each distinct gene is looked up once (see `resolve_gene`); positions
+    of non-polyprotein genes pass through unchanged.
+    """
+    if len(genes) != len(positions):
+        raise ValueError('genes and positions must be of the same length')
+    result_genes: List[str] = []
+    result_positions: List[int] = []
+    for gene, pos in zip(genes, positions):
+        polyprotein, canonical_gene = resolve_gene(gene)
+        if polyprotein is None:
+            result_genes.append(canonical_gene)
+            result_positions.append(pos)
         else:
-            return 'nsp16', pos - 2397
-    elif lower_gene in ('s', 'spike', 'ns2', 'orf2', 'gp02'):
-        return 'S', pos
-    elif lower_gene in ('ns3', 'orf3', 'gp03'):
-        return 'ORF3', pos
-    elif lower_gene in ('e', 'ns4', 'orf4', 'gp04'):
-        return 'E', pos
-    elif lower_gene in ('m', 'ns5', 'orf5', 'gp05'):
-        return 'M', pos
-    elif lower_gene in ('ns6', 'orf6', 'gp06'):
-        return 'ORF6', pos
-    elif lower_gene in ('ns7a', 'orf7a', 'gp07'):
-        return 'ORF7a', pos
-    elif lower_gene in ('ns7b', 'orf7b', 'gp08'):
-        return 'ORF7b', pos
-    elif lower_gene in ('ns8', 'orf8', 'gp09'):
-        return 'ORF8', pos
-    elif lower_gene in ('n', 'ns9', 'orf9', 'gp10'):
-        return 'N', pos
-    elif lower_gene in ('ns10', 'orf10', 'gp11'):
-        return 'ORF10', pos
-    return gene, pos
+            idx = bisect_left(polyprotein.bounds, pos)
+            result_genes.append(polyprotein.genes[idx])
+            result_positions.append(pos - polyprotein.offsets[idx])
+    return result_genes, result_positions
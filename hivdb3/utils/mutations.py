@@ -1,6 +1,11 @@
 import re
-from copy import deepcopy
-from typing import List, Tuple, Set, Dict, Optional
+from array import array
+from bisect import bisect_left
+from typing import (
+    List, Tuple, Set, Dict, Optional, Iterable, Iterator, Mapping,
+    MutableMapping, Callable, Any, Union, FrozenSet, Match, NamedTuple
+)
+from functools import lru_cache
 from itertools import chain
 
 
@@ -17,71 +22,565 @@ MUTATION_PATTERN = re.compile(r"""
 """, re.VERBOSE)
 
 GENE_ORDER = ['CA', 'PR', 'RT', 'IN']
+GENE_RANK: Dict[str, int] = {gene: idx for idx, gene in enumerate(GENE_ORDER)}
+
+# (gene or None if not specified, position, AAs bitmask)
+ParsedMutation = Tuple[Optional[str], int, int]
+
+# Max entries of each of the memoized parsers below
+PARSE_CACHE_SIZE = 65536
+
+# Every amino acid accepted by MUTATION_PATTERN, in `sorted()` order so
+# that walking the bits of a mask from low to high yields sorted AAs
+AA_CODES: List[str] = [
+    '*', 'A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N',
+    'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'X', 'Y', 'del', 'ins'
+]
+AA_BITS: Dict[str, int] = {aa: 1 << i for i, aa in enumerate(AA_CODES)}
+INDEL_MASK: int = AA_BITS['ins'] | AA_BITS['del']
+
+# A mutation is packed as `pos << POS_SHIFT | mask` into one unsigned
+# 64-bit integer; sorting packed values therefore sorts by position
+POS_SHIFT = 32
+MASK_FILTER = (1 << POS_SHIFT) - 1
+PACKED_TYPECODE = 'Q'
+EMPTY_PACKED: 'array[int]' = array(PACKED_TYPECODE)
+
+
+def aas_to_mask(aas: Iterable[str]) -> int:
+    mask = 0
+    for aa in aas:
+        if aa not in AA_BITS:
+            raise ValueError(f'Invalid amino acid: {aa!r}')
+        mask |= AA_BITS[aa]
+    return mask
+
+
+def mask_to_aas(mask: int) -> List[str]:
+    """
+    Bitmask -> sorted list of amino acids
+    """
+    return [aa for aa, bit in AA_BITS.items() if mask & bit]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_aas(aas_text: str) -> int:
+    """
+    Mutation AAs text (e.g. "KR", "N/ins", "del") -> bitmask
+    """
+    mask = 0
+    if 'ins' in aas_text:
+        mask |= AA_BITS['ins']
+    if 'del' in aas_text:
+        mask |= AA_BITS['del']
+    return mask | aas_to_mask(aas_text
+                              .replace('/', '')
+                              .replace('ins', '')
+                              .replace('del', ''))
+
+
+def parse_match(match: Match[str]) -> ParsedMutation:
+    named: Dict[str, Optional[str]] = match.groupdict()
+    if named['pos'] is None or named['aas'] is None:
+        raise RuntimeError('pos or aas is None, check MUTATION_PATTERN')
+    return named['gene'], int(named['pos']), parse_aas(named['aas'])
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_mutation(token: str) -> ParsedMutation:
+    """
+    Single mutation (e.g. "RT:M184V") -> (gene, pos, mask)
+    """
+    match = MUTATION_PATTERN.fullmatch(token.strip())
+    if match is None:
+        raise ValueError(f'Invalid mutation: {token!r}')
+    return parse_match(match)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_mutation_list(text: str) -> Tuple[ParsedMutation, ...]:
+    """
+    List of mutations (e.g. "K65R+M184V") -> tuple of (gene, pos, mask)
+
+    Anything not matching MUTATION_PATTERN is skipped, the same as
+    `MUTATION_PATTERN.finditer`.
+    """
+    return tuple(
+        parse_match(match)
+        for match in MUTATION_PATTERN.finditer(text)
+    )
+
+
+class MutationBatch(NamedTuple):
+    """
+    Columnar parse result; `rows[i]` is the input row of mutation i
+    """
+    rows: 'array[int]'
+    genes: List[str]
+    positions: 'array[int]'
+    masks: 'array[int]'
+
+
+def parse_mutations_batch(
+    column: Iterable[Optional[str]],
+    default_gene: str
+) -> MutationBatch:
+    """
+    Parse a whole worksheet column of mutation lists at once
+
+    Rows that are None are skipped. Genes not given in a mutation are
+    filled with `default_gene`.
+    """
+    batch = MutationBatch(array('I'), [], array('I'), array('I'))
+    for row, text in enumerate(column):
+        if text is None:
+            continue
+        for gene, pos, mask in parse_mutation_list(text):
+            batch.rows.append(row)
+            batch.genes.append(gene or default_gene)
+            batch.positions.append(pos)
+            batch.masks.append(mask)
+    return batch
+
+
+def merge_packed(
+    left: 'array[int]',
+    right: 'array[int]',
+    combine: Callable[[int, int], int]
+) -> 'array[int]':
+    """
+    Merge two sorted packed arrays
+
+    Masks at positions found in both arrays are combined with
+    `combine`; a combined (or right-only) mask of 0 drops the position.
+    """
+    result: 'array[int]' = array(PACKED_TYPECODE)
+    i = j = 0
+    size_left = len(left)
+    size_right = len(right)
+    while i < size_left and j < size_right:
+        lpos = left[i] >> POS_SHIFT
+        rpos = right[j] >> POS_SHIFT
+        if lpos < rpos:
+            result.append(left[i])
+            i += 1
+        elif lpos > rpos:
+            if right[j] & MASK_FILTER:
+                result.append(right[j])
+            j += 1
+        else:
+            mask = combine(left[i] & MASK_FILTER, right[j] & MASK_FILTER)
+            if mask:
+                result.append(lpos << POS_SHIFT | mask)
+            i += 1
+            j += 1
+    result.extend(left[i:])
+    result.extend(packed for packed in right[j:] if packed & MASK_FILTER)
+    return result
+
+
+class MutationSet(MutableMapping[GenePos, Set[str]]):
+    """
+    Compact mutation map
+
+    Mutations are stored per gene in a sorted array of 64-bit integers,
+    each packing a position and a bitmask of its amino acids (see
+    AA_CODES). Copy, override, union and equality work directly on the
+    arrays.
+
+    A MutationSet can also be a copy-on-write overlay (see `derive`):
+    it then only stores its own overrides, with a mask of 0 marking a
+    position removed from the parent, plus the set of genes still
+    visible from the parent. The parent is frozen once derived from.
+    Reads go through the overlay chain; the flattened view is only
+    built when the whole map is iterated, and kept until the overlay
+    is modified.
+
+    The MutableMapping interface is a compatibility shim for code
+    written against `Dict[GenePos, Set[str]]`: `__getitem__` returns a
+    new set, so mutating it does not change the MutationSet.
+    """
+    __slots__ = ('_genes', '_parent', '_scope', '_frozen', '_flat')
+
+    _genes: Dict[str, 'array[int]']
+    _parent: Optional['MutationSet']
+    _scope: Optional[FrozenSet[str]]
+    _frozen: bool
+    _flat: Optional[Dict[str, 'array[int]']]
+
+    def __init__(
+        self,
+        mutations: Union[
+            'MutationSet',
+            Mapping[GenePos, Iterable[str]]
+        ] = {}
+    ) -> None:
+        self._genes = {}
+        self._parent = None
+        self._scope = None
+        self._frozen = False
+        self._flat = None
+        if isinstance(mutations, MutationSet):
+            self.override(mutations)
+        else:
+            for (gene, pos), aas in mutations.items():
+                self.set_mask(gene, pos, aas_to_mask(aas))
+
+    @classmethod
+    def from_masks(
+        cls,
+        masks: Iterable[Tuple[str, int, int]]
+    ) -> 'MutationSet':
+        mutset = cls()
+        for gene, pos, mask in masks:
+            mutset.set_mask(gene, pos, mask)
+        return mutset
+
+    # overlay API
+
+    def derive(self) -> 'MutationSet':
+        """
+        New empty overlay on top of this MutationSet
+
+        This MutationSet is frozen, since the overlay depends on it.
+        """
+        self._frozen = True
+        overlay = MutationSet()
+        overlay._parent = self
+        return overlay
+
+    def materialize(self) -> 'MutationSet':
+        """
+        Flattened, standalone copy of this MutationSet
+        """
+        mutset = MutationSet()
+        mutset._genes = {
+            gene: array(PACKED_TYPECODE, packed)
+            for gene, packed in self._flatten().items()
+        }
+        return mutset
+
+    def _begin_modify(self) -> None:
+        if self._frozen:
+            raise RuntimeError(
+                'MutationSet is frozen since it is the parent of an overlay'
+            )
+        self._flat = None
+
+    def _parent_mask(self, gene: str, pos: int) -> int:
+        if self._parent is None or (
+            self._scope is not None and gene not in self._scope
+        ):
+            return 0
+        return self._parent.get_mask(gene, pos)
+
+    def _flatten(self) -> Dict[str, 'array[int]']:
+        """
+        Flattened per-gene arrays; must not be modified by the caller
+
+        Cached until the next modification, which the frozen parents of
+        an overlay can not have.
+        """
+        if self._parent is None:
+            return self._genes
+        if self._flat is not None:
+            return self._flat
+        flat: Dict[str, 'array[int]'] = {
+            gene: packed
+            for gene, packed in self._parent._flatten().items()
+            if self._scope is None or gene in self._scope
+        }
+        for gene, delta in self._genes.items():
+            merged = merge_packed(
+                flat.get(gene, EMPTY_PACKED), delta, lambda _, right: right)
+            if merged:
+                flat[gene] = merged
+            else:
+                flat.pop(gene, None)
+        self._flat = flat
+        return flat
+
+    # bitmask API
+
+    def get_mask(self, gene: str, pos: int) -> int:
+        packed = self._genes.get(gene)
+        if packed is not None:
+            idx = bisect_left(packed, pos << POS_SHIFT)
+            if idx < len(packed) and packed[idx] >> POS_SHIFT == pos:
+                return packed[idx] & MASK_FILTER
+        return self._parent_mask(gene, pos)
+
+    def set_mask(self, gene: str, pos: int, mask: int) -> None:
+        """
+        Set the AAs bitmask of a position; a mask of 0 removes it
+        """
+        self._begin_modify()
+        # an overlay keeps a 0 mask to hide the parent's mutation
+        store = bool(mask) or bool(self._parent_mask(gene, pos))
+        value = pos << POS_SHIFT | mask
+        packed = self._genes.get(gene)
+        if packed is None:
+            if store:
+                self._genes[gene] = array(PACKED_TYPECODE, [value])
+            return
+        idx = bisect_left(packed, pos << POS_SHIFT)
+        found = idx < len(packed) and packed[idx] >> POS_SHIFT == pos
+        if store and found:
+            packed[idx] = value
+        elif store:
+            packed.insert(idx, value)
+        elif found:
+            del packed[idx]
+            if not packed:
+                del self._genes[gene]
+
+    def genes(self) -> List[str]:
+        return list(self._flatten())
+
+    def iter_masks(
+        self,
+        genes: Optional[Iterable[str]] = None
+    ) -> Iterator[Tuple[str, int, int]]:
+        """
+        Yield (gene, pos, mask); positions are ascending within a gene
+        """
+        flat = self._flatten()
+        for gene in flat if genes is None else genes:
+            for packed in flat.get(gene, EMPTY_PACKED):
+                yield gene, packed >> POS_SHIFT, packed & MASK_FILTER
+
+    def copy(self) -> 'MutationSet':
+        """
+        Shallow copy; an overlay copy shares the parent of the original
+        """
+        mutset = MutationSet()
+        mutset._parent = self._parent
+        mutset._scope = self._scope
+        mutset._genes = {
+            gene: array(PACKED_TYPECODE, packed)
+            for gene, packed in self._genes.items()
+        }
+        return mutset
+
+    def override(self, other: 'MutationSet') -> None:
+        """
+        In-place update; positions of `other` replace those of self
+        """
+        self._begin_modify()
+        for gene, packed in other._flatten().items():
+            if gene in self._genes:
+                self._genes[gene] = merge_packed(
+                    self._genes[gene], packed, lambda _, right: right)
+            else:
+                self._genes[gene] = array(PACKED_TYPECODE, packed)
+
+    def union(self, other: 'MutationSet') -> 'MutationSet':
+        """
+        New MutationSet with the AAs of both sets at each position
+        """
+        mutset = self.materialize()
+        for gene, packed in other._flatten().items():
+            if gene in mutset._genes:
+                mutset._genes[gene] = merge_packed(
+                    mutset._genes[gene], packed, int.__or__)
+            else:
+                mutset._genes[gene] = array(PACKED_TYPECODE, packed)
+        return mutset
+
+    def restrict(self, genes: Iterable[str]) -> None:
+        """
+        In-place removal of all genes not listed in `genes`
+        """
+        self._begin_modify()
+        keep = frozenset(genes)
+        for gene in list(self._genes):
+            if gene not in keep:
+                del self._genes[gene]
+        if self._parent is not None:
+            self._scope = keep if self._scope is None else self._scope & keep
+
+    def to_dict(self) -> Dict[GenePos, Set[str]]:
+        return {
+            (gene, pos): set(mask_to_aas(mask))
+            for gene, pos, mask in self.iter_masks()
+        }
+
+    # dict API shim
+
+    def __getitem__(self, genepos: GenePos) -> Set[str]:
+        mask = self.get_mask(*genepos)
+        if not mask:
+            raise KeyError(genepos)
+        return set(mask_to_aas(mask))
+
+    def __setitem__(self, genepos: GenePos, aas: Iterable[str]) -> None:
+        mask = aas_to_mask(aas)
+        if not mask:
+            raise ValueError('Mutation AAs can not be empty')
+        self.set_mask(genepos[0], genepos[1], mask)
+
+    def __delitem__(self, genepos: GenePos) -> None:
+        if not self.get_mask(*genepos):
+            raise KeyError(genepos)
+        self.set_mask(genepos[0], genepos[1], 0)
+
+    def __contains__(self, genepos: object) -> bool:
+        if not isinstance(genepos, tuple) or len(genepos) != 2:
+            return False
+        return self.get_mask(*genepos) != 0
+
+    def __iter__(self) -> Iterator[GenePos]:
+        for gene, pos, _ in self.iter_masks():
+            yield gene, pos
+
+    def __len__(self) -> int:
+        return sum(len(packed) for packed in self._flatten().values())
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        if len(args) == 1 and not kwargs and \
+                isinstance(args[0], MutationSet):
+            self.override(args[0])
+        else:
+            super().update(*args, **kwargs)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, MutationSet):
+            return self._flatten() == other._flatten()
+        if isinstance(other, Mapping):
+            return self.to_dict() == {
+                genepos: set(aas) for genepos, aas in other.items()
+            }
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return 'MutationSet({!r})'.format(self.to_dict())
+
+    def __getstate__(self) -> Tuple[
+        Dict[str, 'array[int]'],
+        Optional['MutationSet'],
+        Optional[FrozenSet[str]],
+        bool
+    ]:
+        return self._genes, self._parent, self._scope, self._frozen
+
+    def __setstate__(self, state: Tuple[
+        Dict[str, 'array[int]'],
+        Optional['MutationSet'],
+        Optional[FrozenSet[str]],
+        bool
+    ]) -> None:
+        self._genes, self._parent, self._scope, self._frozen = state
+        self._flat = None
+
+
+def find_back_mutations(
+    mutations: List[Tuple[str, int, int]],
+    refmap: Mapping[GenePos, str]
+) -> List[bool]:
+    """
+    For each (gene, position, AAs bitmask), test if it is the reference
+    AA of `refmap`
+
+    A `ReferenceSequences` is tested gene by gene with its batch
+    `is_back_mutation`, rather than position by position.
+    """
+    # imported here since reference depends on this module
+    from .reference import ReferenceSequences
+    if not isinstance(refmap, ReferenceSequences):
+        return [
+            (refaa := refmap.get((gene, pos))) is not None and
+            mask == AA_BITS.get(refaa)
+            for gene, pos, mask in mutations
+        ]
+    indices: Dict[str, List[int]] = {}
+    for idx, (gene, _, _) in enumerate(mutations):
+        indices.setdefault(gene, []).append(idx)
+    result = [False] * len(mutations)
+    for gene, gene_indices in indices.items():
+        for idx, is_back in zip(gene_indices, refmap.is_back_mutation(
+            gene,
+            [mutations[idx][1] for idx in gene_indices],
+            [mutations[idx][2] for idx in gene_indices]
+        )):
+            result[idx] = is_back
+    return result
 
 
 def load_mutations(
     *delta_mutations: str,
     default_gene: str,
-    baseline_mutmap: Dict[GenePos, Set[str]] = {},
-    refmap: Dict[GenePos, str] = {}
-) -> Dict[GenePos, Set[str]]:
+    baseline_mutmap: Mapping[GenePos, Iterable[str]] = {},
+    refmap: Mapping[GenePos, str] = {}
+) -> MutationSet:
     """
-    List of mutations -> dict lookup
+    List of mutations -> MutationSet
 
     @param: delta_mutations list of mutations from baseline strain
     @param: default_gene default gene if gene is not come with a delta mutation
-    @param: baseline_mutmap dict of mutations from refseq of baseline strain
+    @param: baseline_mutmap mutations from refseq of baseline strain
     @param: refmap dict of reference (consensus B) amino acids
     """
     mentioned_genes = {default_gene}
-    mutmap: Dict[GenePos, Set[str]] = deepcopy(baseline_mutmap)
-    for m in chain(*[
-        MUTATION_PATTERN.finditer(delta)
-        for delta in delta_mutations
-    ]):
-        named: Dict[str, Optional[str]] = m.groupdict()
-        if named['pos'] is None or named['aas'] is None:
-            raise RuntimeError('pos or aas is None, check MUTATION_PATTERN')
-        genepos: GenePos = (
-            named['gene'] or default_gene,
-            int(named['pos'])
+    mutmap: MutationSet
+    if isinstance(baseline_mutmap, MutationSet):
+        # copy-on-write: only store changes made by delta_mutations
+        mutmap = baseline_mutmap.derive()
+    else:
+        mutmap = MutationSet(baseline_mutmap)
+    mutations = [
+        (maybe_gene or default_gene, pos, mask)
+        for maybe_gene, pos, mask in chain.from_iterable(
+            parse_mutation_list(delta)
+            for delta in delta_mutations
         )
-        mentioned_genes.add(genepos[0])
-        aas: Set[str] = set(named['aas']
-                            .replace('/', '')
-                            .replace('ins', '')
-                            .replace('del', ''))
-        if 'ins' in named['aas']:
-            aas.add('ins')
-        if 'del' in named['aas']:
-            aas.add('del')
-
-        if aas == {refmap.get(genepos)}:
-            # remove back mutations
-            mutmap.pop(genepos, None)
-        else:
-            mutmap[genepos] = aas
+    ]
+    for (gene, pos, mask), is_back in zip(
+        mutations, find_back_mutations(mutations, refmap)
+    ):
+        mentioned_genes.add(gene)
+        # remove back mutations
+        mutmap.set_mask(gene, pos, 0 if is_back else mask)
     # remove mutations from other genes
-    for genepos in list(mutmap.keys()):
-        if genepos[0] not in mentioned_genes:
-            mutmap.pop(genepos)
+    mutmap.restrict(mentioned_genes)
     return mutmap
 
 
-def dump_mutations(mutmap: Dict[GenePos, Set[str]]) -> Dict[str, str]:
-    mutlist: Dict[str, List[str]] = {}
-    for (gene, pos), aas in sorted(
-        mutmap.items(),
-        key=lambda m: (GENE_ORDER.index(m[0][0]), m[0][1])
-    ):
-        if 'ins' in aas or 'del' in aas:
-            aatext = '/'.join(sorted(aas))
-        else:
-            aatext = ''.join(sorted(aas))
-        if gene not in mutlist:
-            mutlist[gene] = []
-        mutlist[gene].append('{}{}'.format(pos, aatext))
+@lru_cache(maxsize=None)
+def mask_to_text(mask: int) -> str:
+    """
+    Bitmask -> mutation AAs text (e.g. "IV", "N/ins")
+    """
+    if mask & INDEL_MASK:
+        return '/'.join(mask_to_aas(mask))
+    else:
+        return ''.join(mask_to_aas(mask))
+
+
+def dump_gene_mutations(mutset: MutationSet, gene: str) -> str:
+    return '+'.join(
+        '{}{}'.format(pos, mask_to_text(mask))
+        for _, pos, mask in mutset.iter_masks([gene])
+    )
+
+
+def dump_mutations(
+    mutmap: Mapping[GenePos, Iterable[str]],
+    genes: Optional[Iterable[str]] = None
+) -> Dict[str, str]:
+    """
+    Mutation map -> {'<gene> Mutations': '<pos><AAs>+...'}
+
+    @param: genes only serialize these genes (default: all genes)
+    """
+    mutset: MutationSet = (
+        mutmap if isinstance(mutmap, MutationSet)
+        else MutationSet(mutmap)
+    )
+    if genes is None:
+        genes = mutset.genes()
+    else:
+        genes = set(genes) & set(mutset.genes())
     return {
-        f'{gene} Mutations': '+'.join(muts)
-        for gene, muts in mutlist.items()
+        f'{gene} Mutations': dump_gene_mutations(mutset, gene)
+        for gene in sorted(genes, key=GENE_RANK.__getitem__)
     }
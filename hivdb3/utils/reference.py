@@ -0,0 +1,128 @@
+import json
+import mmap
+from typing import (
+    Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union, IO, Any
+)
+
+from .mutations import GenePos, AA_BITS
+
+REFSEQ_MAGIC = b'HIVDB3-REFSEQ-1\n'
+
+# AA byte -> bitmask of `mutations.AA_CODES`; 0 for anything else
+AA_BYTE_BITS: List[int] = [AA_BITS.get(chr(byte), 0) for byte in range(256)]
+
+SeqBuffer = Union[bytes, memoryview]
+
+
+class ReferenceSequences(Mapping[GenePos, str]):
+    """
+    Reference amino acid sequences, one contiguous buffer per gene
+
+    Works as a read-only `Mapping[GenePos, str]` (positions are
+    1-based), so it can be used wherever the old per-position dict was,
+    e.g. as `refmap` of `load_mutations`. Iteration yields positions
+    gene by gene in input order.
+
+    A ReferenceSequences saved with `dump` can be loaded back with
+    `load`, which memory-maps the file instead of reading it.
+    """
+
+    def __init__(self, seqs: Mapping[str, SeqBuffer]) -> None:
+        self._seqs: Dict[str, SeqBuffer] = dict(seqs)
+        self._mmap: Optional[mmap.mmap] = None
+
+    @property
+    def genes(self) -> List[str]:
+        return list(self._seqs)
+
+    def sequence(self, gene: str) -> SeqBuffer:
+        return self._seqs[gene]
+
+    def get_aa(self, gene: str, pos: int) -> Optional[str]:
+        seq = self._seqs.get(gene)
+        if seq is None or not 0 < pos <= len(seq):
+            return None
+        return chr(seq[pos - 1])
+
+    def is_back_mutation(
+        self,
+        gene: str,
+        positions: Sequence[int],
+        masks: Sequence[int]
+    ) -> List[bool]:
+        """
+        For each (position, AAs bitmask), test if it is the reference AA
+        """
+        seq = self._seqs.get(gene, b'')
+        size = len(seq)
+        return [
+            0 < pos <= size and mask == AA_BYTE_BITS[seq[pos - 1]]
+            for pos, mask in zip(positions, masks)
+        ]
+
+    def get(  # type: ignore[override]
+        self,
+        genepos: GenePos,
+        default: Optional[str] = None
+    ) -> Optional[str]:
+        aa = self.get_aa(*genepos)
+        return default if aa is None else aa
+
+    def __getitem__(self, genepos: GenePos) -> str:
+        aa = self.get_aa(*genepos)
+        if aa is None:
+            raise KeyError(genepos)
+        return aa
+
+    def __contains__(self, genepos: object) -> bool:
+        if not isinstance(genepos, tuple) or len(genepos) != 2:
+            return False
+        return self.get_aa(*genepos) is not None
+
+    def __iter__(self) -> Iterator[GenePos]:
+        for gene, seq in self._seqs.items():
+            for pos0 in range(len(seq)):
+                yield gene, pos0 + 1
+
+    def __len__(self) -> int:
+        return sum(len(seq) for seq in self._seqs.values())
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # memory-mapped buffers can not be pickled
+        return ReferenceSequences, ({
+            gene: bytes(seq) for gene, seq in self._seqs.items()
+        },)
+
+    def dump(self, fp: IO[bytes]) -> None:
+        """
+        Write the sequences as a header line followed by the buffers
+        """
+        offset = 0
+        index: Dict[str, Tuple[int, int]] = {}
+        for gene, seq in self._seqs.items():
+            index[gene] = (offset, len(seq))
+            offset += len(seq)
+        fp.write(REFSEQ_MAGIC)
+        fp.write(json.dumps(index).encode('UTF-8') + b'\n')
+        for seq in self._seqs.values():
+            fp.write(seq)
+
+    @classmethod
+    def load(cls, fp: IO[bytes]) -> 'ReferenceSequences':
+        """
+        Memory-map a file written by `dump`; `fp` can be closed after
+        """
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(REFSEQ_MAGIC)] != REFSEQ_MAGIC:
+            buf.close()
+            raise ValueError(f'{fp.name} is not a reference sequences file')
+        header_end = buf.find(b'\n', len(REFSEQ_MAGIC)) + 1
+        index: Dict[str, Tuple[int, int]] = json.loads(
+            buf[len(REFSEQ_MAGIC):header_end])
+        view = memoryview(buf)[header_end:]
+        refseqs = cls({
+            gene: view[offset:offset + size]
+            for gene, (offset, size) in index.items()
+        })
+        refseqs._mmap = buf
+        return refseqs
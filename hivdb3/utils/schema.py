@@ -0,0 +1,161 @@
+import re
+import click
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Pattern, Sequence,
+    Tuple, Union
+)
+
+from .csvv import CSVReaderRow
+from .cache import default_cache
+
+Column = List[Optional[str]]
+# (row index, message)
+SchemaError = Tuple[int, str]
+
+
+def split_items(value: str, separator: str) -> List[str]:
+    return re.split(separator, value)
+
+
+class NotNull(NamedTuple):
+    column: str
+    allow_empty: bool = True
+
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def check(self, data: Dict[str, Column]) -> Iterator[SchemaError]:
+        for idx, value in enumerate(data[self.column]):
+            if value is None or (value == '' and not self.allow_empty):
+                yield idx, '{!r} is empty'.format(self.column)
+
+
+class OneOf(NamedTuple):
+    column: str
+    choices: Tuple[str, ...]
+
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def check(self, data: Dict[str, Column]) -> Iterator[SchemaError]:
+        choices = set(self.choices)
+        for idx, value in enumerate(data[self.column]):
+            if value is not None and value not in choices:
+                yield idx, '{!r} must be one of {}, not {!r}'.format(
+                    self.column, ', '.join(self.choices), value)
+
+
+class Matches(NamedTuple):
+    """
+    Every (`separator`-split) value of a column fully matches `pattern`
+    """
+    column: str
+    pattern: str
+    description: str
+    separator: Optional[str] = None
+
+    def columns(self) -> Tuple[str, ...]:
+        return (self.column,)
+
+    def check(self, data: Dict[str, Column]) -> Iterator[SchemaError]:
+        regex: Pattern[str] = re.compile(self.pattern)
+        # worksheet columns are highly repetitive; match each value once
+        verdicts: Dict[str, List[str]] = {}
+        for idx, value in enumerate(data[self.column]):
+            if value is None:
+                continue
+            if value not in verdicts:
+                items = (
+                    [value] if self.separator is None
+                    else split_items(value, self.separator)
+                )
+                verdicts[value] = [
+                    item for item in items if not regex.fullmatch(item)]
+            for item in verdicts[value]:
+                yield idx, 'Invalid {} {!r} in {!r}'.format(
+                    self.description, item, self.column)
+
+
+class SameArity(NamedTuple):
+    """
+    The `separator`-split values of the columns have the same sizes
+    """
+    column_names: Tuple[str, ...]
+    separator: str
+
+    def columns(self) -> Tuple[str, ...]:
+        return self.column_names
+
+    def check(self, data: Dict[str, Column]) -> Iterator[SchemaError]:
+        for idx, values in enumerate(zip(*(
+            data[col] for col in self.column_names
+        ))):
+            if any(value is None for value in values):
+                # reported by NotNull
+                continue
+            sizes = {
+                len(split_items(value or '', self.separator))
+                for value in values
+            }
+            if len(sizes) > 1:
+                yield idx, 'The sizes of {} are not the same'.format(
+                    ' and '.join(repr(col) for col in self.column_names))
+
+
+Rule = Union[NotNull, OneOf, Matches, SameArity]
+
+
+class Schema(NamedTuple):
+    """
+    Declarative validation of a worksheet
+
+    Rules are checked column by column over all rows, and every
+    violation is reported rather than only the first one.
+    """
+    name: str
+    rules: Tuple[Rule, ...]
+
+    def columns(self) -> List[str]:
+        return list(dict.fromkeys(
+            col for rule in self.rules for col in rule.columns()))
+
+    def validate(self, rows: Sequence[CSVReaderRow]) -> List[str]:
+        data: Dict[str, Column] = {
+            col: [row.get(col) for row in rows]
+            for col in self.columns()
+        }
+        errors: List[SchemaError] = []
+        for rule in self.rules:
+            errors.extend(rule.check(data))
+        # stable, so errors of a row keep the order of the rules
+        errors.sort(key=lambda error: error[0])
+        return [
+            '{} at row {}'.format(message, idx + 2)
+            for idx, message in errors
+        ]
+
+
+def validate_worksheet(
+    filename: str,
+    schema: Schema,
+    rows: Iterable[CSVReaderRow]
+) -> None:
+    """
+    Validate the rows of a worksheet, echo all errors and abort if any
+
+    The result is cached by the content of the worksheet, so unchanged
+    worksheets are not validated again.
+    """
+    errors: List[str] = default_cache.cached(
+        'schema-{}'.format(schema.name),
+        [filename],
+        lambda: schema.validate(list(rows)),
+        modules=[__name__],
+        salt=repr(schema)
+    )
+    if errors:
+        for error in errors:
+            click.echo('({}) {}'.format(filename, error), err=True)
+        click.echo('{} error(s) in {}'.format(len(errors), filename),
+                   err=True)
+        raise click.Abort()
@@ -4,13 +4,22 @@ set -e
 
 VERSION=$1
 
-python3 -m hivdb3.entry db-to-sqlite "postgresql://postgres@hivdb3-devdb:5432/postgres" /dev/shm/hivdb3-$VERSION.db --all
+if [ -f build/sqls/.derived-csvs ]; then
+    # the devdb loaded build/derived instead of running derived_tables/*.sql
+    # (see export-sqls.sh): check its derived tables against the SQL
+    python3 -m hivdb3.entry generate-derived-tables --check derived_tables --check-url "postgresql://postgres@hivdb3-devdb:5432/postgres" --check-db
+fi
+
+mkdir -p build/
+# --vacuum-into refuses to overwrite a previous build
+rm -f build/hivdb3-$VERSION.db
+# /dev/shm is rebuilt from scratch on failure: load without journal/fsync;
+# the compact copy goes to build/ so that only one database is in /dev/shm
+python3 -m hivdb3.entry db-to-sqlite "postgresql://postgres@hivdb3-devdb:5432/postgres" /dev/shm/hivdb3-$VERSION.load.db --all --skip derived_tables_applied --workers ${EXPORT_WORKERS:-4} --bulk --vacuum-into build/hivdb3-$VERSION.db
+rm /dev/shm/hivdb3-$VERSION.load.db
 echo "build/hivdb3-$VERSION.db"
-ln -s hivdb3-$VERSION.db /dev/shm/hivdb3-latest.db
+ln -sfn hivdb3-$VERSION.db build/hivdb3-latest.db
 (ls -1 ./views/*.sql 2>/dev/null || true) | sort -h | while read filepath; do
-    sqlite3 /dev/shm/hivdb3-latest.db < $filepath
+    sqlite3 build/hivdb3-latest.db < $filepath
 done
 echo "build/hivdb3-latest.db -> hivdb3-$VERSION.db"
-
-mkdir -p build/
-mv /dev/shm/*.db build/
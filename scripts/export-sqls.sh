@@ -84,9 +84,32 @@ echo "INSERT INTO last_update (scope, last_update) VALUES ('global', '${last_upd
 
 echo "$EXPOSE_DIR/02_data_tables.sql"
 
+# build/derived is only used if `generate-derived-tables` completed after
+# the last change of its inputs: its manifest is saved last, like a stamp
+DERIVED_DIR=
+DERIVED_MANIFEST=build/derived/.derived-manifest.json
+if [ -f $DERIVED_MANIFEST ]; then
+    if [ -z "$(find payload/tables/invitro_selection payload/tables/mutations.d payload/tables/resistance_mutations.csv hivdb3/commands/gen_derived_tables.py -newer $DERIVED_MANIFEST)" ]; then
+        DERIVED_DIR=build/derived
+    else
+        echo "Warning: build/derived is older than payload/tables, running derived_tables/*.sql instead" 1>&2
+    fi
+fi
+
 echo '' > $TARGET_DIR/03_derived_tables.sql
 (ls -1 derived_tables/*.sql 2>/dev/null || true) | sort -h | while read filepath; do
-    cat $filepath >> $TARGET_DIR/03_derived_tables.sql
+    # NN_<table>.sql; load the partitions of build/derived/<table>.d/
+    # instead if computed by `generate-derived-tables`
+    table=$(basename $filepath .sql | sed 's/^[0-9]*_//')
+    if [ -n "$DERIVED_DIR" ] && ls $DERIVED_DIR/$table.d/*.csv >/dev/null 2>&1; then
+        # marker for the check of scripts/export-sqlite.sh
+        touch $TARGET_DIR/.derived-csvs
+        ls -1 $DERIVED_DIR/$table.d/*.csv | while read csvpath; do
+            copy_csv $csvpath $table >> $TARGET_DIR/03_derived_tables.sql
+        done
+    else
+        cat $filepath >> $TARGET_DIR/03_derived_tables.sql
+    fi
 done
 
 (ls -1 constraints_post-import/*.sql 2>/dev/null || true) | while read sql; do